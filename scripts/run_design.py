@@ -6,12 +6,25 @@ sys.path.append(os.environ['COOL3D_ROOT'])
 
 import utils.run as run
 import utils.parse_input as parse_input
+import utils.sweep as sweep
 
 argparser = argparse.ArgumentParser()
 argparser.add_argument('--input-file', type=str, help='Input file in YAML format')
+argparser.add_argument('--jobs', type=int, default=None, help='Maximum number of pipeline stages running concurrently')
+argparser.add_argument('--no-cache', action='store_true', help='Rerun every stage instead of reusing cached results')
+argparser.add_argument('--no-results-db', action='store_true', help='Do not register the runs in the results database')
+argparser.add_argument('--resume', action='store_true', help='Skip the stages completed by a previous run and restart at the first incomplete one')
+argparser.add_argument('--trace', action='store_true', help='Also write the stage timings as a Chrome trace_event file')
+argparser.add_argument('--sweep-jobs', type=int, default=None, help='Number of design points simulated concurrently in sweep mode')
 
 args = argparser.parse_args()
 
-config, workload, outdir = parse_input.parse_input(args.input_file)
+inputs = parse_input.load_input(args.input_file)
 
-run.run(config, workload, outdir)
\ No newline at end of file
+if sweep.find_sweep_params(inputs):
+    # list values in the input file describe a design space sweep
+    sweep.run_sweep(inputs, args.input_file, jobs=args.sweep_jobs, max_workers=args.jobs, use_cache=not args.no_cache, results_db=not args.no_results_db, resume=args.resume, trace=args.trace)
+else:
+    config, workload, outdir = parse_input.parse_inputs(inputs, args.input_file)
+
+    run.run(config, workload, outdir, max_workers=args.jobs, use_cache=not args.no_cache, inputs=inputs, results_db=not args.no_results_db, resume=args.resume, trace=args.trace)
\ No newline at end of file
@@ -0,0 +1,287 @@
+import os
+import json
+import fcntl
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import contextlib
+import xml.etree.ElementTree as ET
+
+DEFAULT_MAX_SIZE = 20 * 1024**3  # bytes
+EVICT_TARGET = 0.9  # fraction of max_size kept by the eviction of a full cache, so that the next stores do not scan it again
+
+def file_digest(path):
+    # @path: str, path to a file
+    # return: sha256 hex digest of the file content
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def dir_digest(path):
+    # @path: str, path to a directory
+    # return: sha256 hex digest over the relative paths and contents of all files in the directory
+
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            h.update(os.path.relpath(file_path, path).encode())
+            h.update(file_digest(file_path).encode())
+    return h.hexdigest()
+
+def xml_digest(path):
+    # @path: str, path to an xml file
+    # return: sha256 hex digest of the canonical form of the xml, insensitive to
+    #         comments, attribute order, indentation and line endings
+
+    h = hashlib.sha256()
+    def update(element):
+        h.update(element.tag.encode())
+        for name, value in sorted(element.attrib.items()):
+            h.update(b'\0' + name.encode() + b'=' + value.encode())
+        h.update(b'\1' + (element.text or '').strip().encode())
+        for child in element:
+            update(child)
+        h.update(b'\2')
+    # comments are dropped by the default parser
+    update(ET.parse(path).getroot())
+    return h.hexdigest()
+
+def make_key(*parts):
+    # @parts: json serializable values describing the inputs of a stage
+    # return: sha256 hex digest of the parts
+
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+class ResultCache:
+    # Content-addressed store of stage results, bounded in size with LRU eviction
+    # @root: str, cache directory, default to $COOL3D_CACHE_DIR or $COOL3D_ROOT/cache
+    # @max_size: int, maximum cache size in bytes, default to $COOL3D_CACHE_SIZE or DEFAULT_MAX_SIZE
+    # The total size of the entries is kept in size.json, so that a store only scans the cache when it is full
+
+    def __init__(self, root=None, max_size=None):
+        if root is None:
+            root = os.environ.get('COOL3D_CACHE_DIR') or os.path.join(os.environ['COOL3D_ROOT'], 'cache')
+        if max_size is None:
+            max_size = int(os.environ.get('COOL3D_CACHE_SIZE', DEFAULT_MAX_SIZE))
+        self.root = root
+        self.max_size = max_size
+        os.makedirs(self.root, exist_ok=True)
+
+    def entry_dir(self, namespace, key):
+        return os.path.join(self.root, namespace, key[:2], key)
+
+    def lookup(self, namespace, key):
+        # return: path to the cached entry directory, or None on miss
+        entry = self.entry_dir(namespace, key)
+        if not os.path.isfile(os.path.join(entry, 'meta.json')):
+            return None
+        try:
+            os.utime(os.path.join(entry, 'meta.json'))  # mark as recently used
+        except OSError:
+            return None
+        return entry
+
+    @contextlib.contextmanager
+    def lock(self, namespace, key):
+        # Serialize the producers of one key across threads and processes, so that
+        # concurrent runs with identical inputs wait for the first one instead of recomputing
+        lock_dir = os.path.join(self.root, 'tmp', 'locks')
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, namespace + '-' + key + '.lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def restore(self, namespace, key, outdir):
+        # Copy a cached entry into outdir
+        # return: True on hit, False on miss
+        entry = self.lookup(namespace, key)
+        if entry is None:
+            return False
+        os.makedirs(outdir, exist_ok=True)
+        try:
+            for name in os.listdir(entry):
+                if name == 'meta.json':
+                    continue
+                src = os.path.join(entry, name)
+                dst = os.path.join(outdir, name)
+                if os.path.isdir(src):
+                    shutil.copytree(src, dst, dirs_exist_ok=True)
+                else:
+                    shutil.copy2(src, dst)
+        except OSError:
+            # evicted by a concurrent run while copying
+            return False
+        print("[COOL-3D] Cache hit for", namespace, key[:12])
+        return True
+
+    def store(self, namespace, key, files, meta=None):
+        # Store files into the cache under the key
+        # @files: list of files or directories, stored by their base names
+        # @meta: dict, extra information stored with the entry
+        entry = self.entry_dir(namespace, key)
+        if os.path.isdir(entry):
+            return entry
+        tmp_root = os.path.join(self.root, 'tmp')
+        os.makedirs(tmp_root, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=tmp_root)
+        size = 0
+        for path in files:
+            dst = os.path.join(tmp, os.path.basename(path))
+            if os.path.isdir(path):
+                shutil.copytree(path, dst)
+            else:
+                shutil.copy2(path, dst)
+        for root, _, names in os.walk(tmp):
+            size += sum(os.path.getsize(os.path.join(root, name)) for name in names)
+        info = dict(meta or {})
+        info.update({'namespace': namespace, 'key': key, 'size': size, 'created': time.time()})
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(info, f, indent=2)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        try:
+            # rename is atomic, concurrent writers of the same key keep the first entry
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            return entry
+        # only scan the entries once the running total says the cache is full
+        if self.add_size(size) > self.max_size:
+            self.evict(int(self.max_size * EVICT_TARGET))
+        return entry
+
+    def size_file(self):
+        return os.path.join(self.root, 'size.json')
+
+    def read_size(self):
+        # return: int, running total of the entry sizes in bytes, None if it was never counted
+        try:
+            with open(self.size_file()) as f:
+                return int(json.load(f)['size'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def write_size(self, total):
+        tmp = self.size_file() + '.%d.tmp' % os.getpid()
+        with open(tmp, 'w') as f:
+            json.dump({'size': total}, f)
+        os.replace(tmp, self.size_file())
+
+    def add_size(self, size):
+        # Add a new entry to the running total, counted by a full scan the first time
+        # @size: int, size of the new entry in bytes
+        # return: int, total size of the cache in bytes
+        with self.lock('cache', 'size'):
+            total = self.read_size()
+            if total is None:
+                # the scan already sees the new entry
+                total = sum(entry_size for _, entry_size, _ in self.entries())
+            else:
+                total += size
+            self.write_size(total)
+        return total
+
+    def entries(self, namespace=None):
+        # @namespace: str, only list the entries of this namespace, default to all
+        # return: list of (last used time, size, entry directory), least recently used first
+        entries = []
+        for name in os.listdir(self.root):
+            if name == 'tmp' or namespace not in [None, name]:
+                continue
+            namespace_dir = os.path.join(self.root, name)
+            for meta_path in glob_entries(namespace_dir):
+                try:
+                    with open(meta_path) as f:
+                        size = json.load(f)['size']
+                    entries.append((os.path.getmtime(meta_path), size, os.path.dirname(meta_path)))
+                except (OSError, ValueError, KeyError):
+                    continue
+        entries.sort()
+        return entries
+
+    def evict(self, max_size=None):
+        # Remove least recently used entries until the cache fits in max_size bytes
+        if max_size is None:
+            max_size = self.max_size
+        with self.lock('cache', 'size'):
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if total <= max_size:
+                    break
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+            # recounted from the scan, so entries removed by hand are forgotten too
+            self.write_size(total)
+        return total
+
+    def prune(self, namespace=None, older_than=None):
+        # Remove the entries not used for older_than seconds
+        # @namespace: str, only prune this namespace, default to all
+        # @older_than: float, age in seconds, default to removing every entry
+        # return: number of removed entries
+        removed = 0
+        now = time.time()
+        with self.lock('cache', 'size'):
+            for used, _, entry in self.entries(namespace):
+                if older_than is None or now - used > older_than:
+                    shutil.rmtree(entry, ignore_errors=True)
+                    removed += 1
+            self.write_size(sum(size for _, size, _ in self.entries()))
+        return removed
+
+def glob_entries(namespace_dir):
+    # return: list of meta.json paths of all entries in a namespace directory
+    metas = []
+    if not os.path.isdir(namespace_dir):
+        return metas
+    for prefix in os.listdir(namespace_dir):
+        prefix_dir = os.path.join(namespace_dir, prefix)
+        if not os.path.isdir(prefix_dir):
+            continue
+        for key in os.listdir(prefix_dir):
+            meta_path = os.path.join(prefix_dir, key, 'meta.json')
+            if os.path.isfile(meta_path):
+                metas.append(meta_path)
+    return metas
+
+def exec_stamp(path):
+    # @path: str, path to a simulator executable
+    # return: cheap identity of the executable, rebuilding the simulator changes it
+    try:
+        st = os.stat(path)
+        return [os.path.abspath(path), st.st_size, st.st_mtime]
+    except OSError:
+        return [path]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect and prune the Cool-3D result cache')
+    parser.add_argument('command', choices=['list', 'prune'], help='list the entries or remove them')
+    parser.add_argument('--cache-dir', type=str, help='cache directory, default to $COOL3D_CACHE_DIR or $COOL3D_ROOT/cache', default=None)
+    parser.add_argument('--namespace', type=str, help='only consider one stage, e.g. mcpat, cacti, hotspot', default=None)
+    parser.add_argument('--older-than', type=float, help='prune entries not used for this many days', default=None)
+    parser.add_argument('--max-size', type=int, help='prune least recently used entries of all stages until the cache fits in this many bytes', default=None)
+
+    args = parser.parse_args()
+    cache = ResultCache(args.cache_dir)
+    if args.command == 'list':
+        entries = cache.entries(args.namespace)
+        for used, size, entry in entries:
+            with open(os.path.join(entry, 'meta.json')) as f:
+                meta = json.load(f)
+            print("%-10s %s %10d %s" % (meta.get('namespace'), meta.get('key', '')[:16], size, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(used))))
+        print("[COOL-3D]", len(entries), "entries,", sum(size for _, size, _ in entries), "bytes in", cache.root)
+    elif args.max_size is not None:
+        print("[COOL-3D] Cache size after pruning:", cache.evict(args.max_size), "bytes")
+    else:
+        older_than = None if args.older_than is None else args.older_than * 86400
+        print("[COOL-3D] Removed", cache.prune(args.namespace, older_than), "cache entries")
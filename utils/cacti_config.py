@@ -0,0 +1,62 @@
+import re
+import argparse
+
+# an active parameter line, e.g. '-size (Gb) 8' or '-Data array cell type - "comm-dram"'
+param_line = re.compile(r'^-(?P<name>.*?)\s+(?P<value>"[^"]*"|\S+)$')
+
+def strip_comment(line):
+    # drop '//' and '#' comments following a parameter, quoted values are kept intact
+    in_quote = False
+    for i, c in enumerate(line):
+        if c == '"':
+            in_quote = not in_quote
+        elif not in_quote and (c == '#' or line.startswith('//', i)):
+            return line[:i]
+    return line
+
+def read_cacti_cfg(cfg_file):
+    # @cfg_file: path to a CACTI-3DD input file
+    # return: dict<parameter name, value> of the active parameters, a later line overrides an earlier one
+
+    params = {}
+    with open(cfg_file) as f:
+        for line in f:
+            line = line.strip()
+            # commented out alternatives start with '//' and notes with '#'
+            if not line.startswith('-'):
+                continue
+            line = ' '.join(strip_comment(line).split())
+            match = param_line.match(line)
+            if match:
+                params[match.group('name')] = match.group('value')
+    return params
+
+def normalize_cacti_cfg(cfg_file):
+    # @cfg_file: path to a CACTI-3DD input file
+    # return: sorted list of [parameter name, value], identical for cfg files describing the same memory
+
+    return sorted([name, value] for name, value in read_cacti_cfg(cfg_file).items())
+
+def write_cacti_cfg(cfg_file, output_file, overrides):
+    # Copy a CACTI-3DD input file with some parameter values replaced
+    # @cfg_file: path to the CACTI-3DD input file
+    # @output_file: path to the modified copy
+    # @overrides: dict<parameter name as returned by read_cacti_cfg, new value>
+
+    with open(cfg_file) as f:
+        lines = f.readlines()
+    with open(output_file, 'w') as f:
+        for line in lines:
+            if line.strip().startswith('-'):
+                match = param_line.match(' '.join(strip_comment(line.strip()).split()))
+                if match and match.group('name') in overrides:
+                    line = '-%s %s\n' % (match.group('name'), overrides[match.group('name')])
+            f.write(line)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the active parameters of a CACTI-3DD input file')
+    parser.add_argument('--input-file', type=str, help='CACTI-3DD input file')
+
+    args = parser.parse_args()
+    for name, value in normalize_cacti_cfg(args.input_file):
+        print(name, '=', value)
@@ -1,13 +1,7 @@
 import argparse
 
-argparser = argparse.ArgumentParser()
-argparser.add_argument('--core-ptrace', type=str, help='core ptrace file')
-argparser.add_argument('--mem-ptrace', type=str, help='mem ptrace file')
-argparser.add_argument('--is-core', type=str, help='is core layer for each layer')
-argparser.add_argument('--banks-per-layer', type=int, help='number of banks per memory layer')
-argparser.add_argument('--coremem-ptrace', type=str, help='output combined ptrace file')
-
 def read_core_ptrace(core_ptrace_file):
+    # return: header list and list of data rows, one row per epoch
     core_ptrace_header = []
     core_ptrace_data = []
 
@@ -17,14 +11,15 @@ def read_core_ptrace(core_ptrace_file):
                 continue
             for header in line.strip().split():
                 core_ptrace_header.append(header)
-            line = f.readline()
-            for data in line.strip().split():
-                core_ptrace_data.append(data)
             break
+        for line in f:
+            if line.strip() and not line.startswith('Warning'):
+                core_ptrace_data.append(line.strip().split())
 
     return core_ptrace_header, core_ptrace_data
 
 def read_mem_ptrace(mem_ptrace_file):
+    # return: header list and list of data rows, one row per epoch
     mem_ptrace_header = []
     mem_ptrace_data = []
 
@@ -32,17 +27,21 @@ def read_mem_ptrace(mem_ptrace_file):
         line = f.readline()
         for header in line.strip().split():
             mem_ptrace_header.append(header)
-        line = f.readline()
-        for data in line.strip().split():
-            mem_ptrace_data.append(data)
+        for line in f:
+            if line.strip():
+                mem_ptrace_data.append(line.strip().split())
 
     return mem_ptrace_header, mem_ptrace_data
 
 def combine_ptrace(core_ptrace_file, mem_ptrace_file, is_core, banks_per_layer, output_file):
+    # a single-row (steady) trace is repeated to match a multi-row (per epoch) trace
 
     num_layers = len(is_core)
-    core_ptrace_header, core_ptrace_data = read_core_ptrace(core_ptrace_file)
-    mem_ptrace_header, mem_ptrace_data = read_mem_ptrace(mem_ptrace_file)
+    core_ptrace_header, core_ptrace_rows = read_core_ptrace(core_ptrace_file)
+    mem_ptrace_header, mem_ptrace_rows = read_mem_ptrace(mem_ptrace_file)
+    num_rows = max(len(core_ptrace_rows), len(mem_ptrace_rows))
+    if len(core_ptrace_rows) not in [1, num_rows] or len(mem_ptrace_rows) not in [1, num_rows]:
+        raise ValueError("Core ptrace has %d rows but mem ptrace has %d rows" % (len(core_ptrace_rows), len(mem_ptrace_rows)))
     mems_cnt = 0
     with open(output_file, 'w') as f:
         for i in range(num_layers):
@@ -52,18 +51,29 @@ def combine_ptrace(core_ptrace_file, mem_ptrace_file, is_core, banks_per_layer,
                 f.write('\t'.join(mem_ptrace_header[mems_cnt * banks_per_layer : (mems_cnt+1) * banks_per_layer]) + '\t')
                 mems_cnt += 1
         f.write('\n')
-        mems_cnt = 0
-        for i in range(num_layers):
-            if is_core[i] == '1':
-                f.write('\t'.join(core_ptrace_data) + '\t')
-            else:
-                f.write('\t'.join(mem_ptrace_data[mems_cnt * banks_per_layer : (mems_cnt+1) * banks_per_layer]) + '\t')
-                mems_cnt += 1
-        f.write('\n')
+        for row in range(num_rows):
+            core_ptrace_data = core_ptrace_rows[row if len(core_ptrace_rows) > 1 else 0]
+            mem_ptrace_data = mem_ptrace_rows[row if len(mem_ptrace_rows) > 1 else 0]
+            mems_cnt = 0
+            for i in range(num_layers):
+                if is_core[i] == '1':
+                    f.write('\t'.join(core_ptrace_data) + '\t')
+                else:
+                    f.write('\t'.join(mem_ptrace_data[mems_cnt * banks_per_layer : (mems_cnt+1) * banks_per_layer]) + '\t')
+                    mems_cnt += 1
+            f.write('\n')
                 
         # f.write('\t'.join(core_ptrace_header) + '\t' + '\t'.join(mem_ptrace_header) + '\n')
         # f.write('\t'.join(core_ptrace_data) + '\t' + '\t'.join(mem_ptrace_data) + '\n')
 
-args = argparser.parse_args()
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('--core-ptrace', type=str, help='core ptrace file')
+    argparser.add_argument('--mem-ptrace', type=str, help='mem ptrace file')
+    argparser.add_argument('--is-core', type=str, help='is core layer for each layer')
+    argparser.add_argument('--banks-per-layer', type=int, help='number of banks per memory layer')
+    argparser.add_argument('--coremem-ptrace', type=str, help='output combined ptrace file')
+
+    args = argparser.parse_args()
 
-combine_ptrace(args.core_ptrace, args.mem_ptrace, args.is_core, args.banks_per_layer, args.coremem_ptrace)
\ No newline at end of file
+    combine_ptrace(args.core_ptrace, args.mem_ptrace, args.is_core, args.banks_per_layer, args.coremem_ptrace)
\ No newline at end of file
@@ -13,7 +13,6 @@ python3 gem52mcpat-parser.py -c config.json -s stats.txt -t ./template_parser.xm
 ]
 
 [testing environment]:
-python 3.6.9
 python 3.8.5
 python 3.13
 
@@ -24,20 +23,25 @@ import sys
 import json
 import re
 from xml.etree import ElementTree as ET
-from xml.dom import minidom
 import copy
-import types
 import logging
 from math import log2
 
+try:
+    from utils.stats import load_stats, parse_value
+    from utils.template_expr import compile_value
+    from utils.gem5_config import ConfigKeyError, as_config
+except ImportError:  # run as a script from the utils directory
+    from stats import load_stats, parse_value
+    from template_expr import compile_value
+    from gem5_config import ConfigKeyError, as_config
+
 logging.basicConfig(level=logging.WARNING) #logging.DEBUG for debugging
 
+# config.json fields that name a core or connect it to the rest of the system rather than describe it
+CORE_IDENTITY_KEYS = {"name", "path", "cpu_id", "socket_id", "peer", "workload"}
 
-def prettify(elem):
-    """Return a pretty-printed XML string for the Element."""
-    rough_string = ET.tostring(elem, "utf-8")
-    reparsed = minidom.parseString(rough_string)
-    return reparsed.toprettyxml(indent="  ")
+coreStatPattern = re.compile(r"^system\.cpu(\d+)\.(.+)$")
 
 
 def create_parser():
@@ -78,6 +82,11 @@ def create_parser():
         metavar="PATH",
         help="Output file for McPAT input in XML format (default: mcpat-in.xml)",
     )
+    parser.add_argument(
+        "--homogeneous",
+        action="store_true",
+        help="Model identical cores as one core with their average stats (homogeneous_cores=1).",
+    )
 
     return parser
 
@@ -113,30 +122,12 @@ def parse(source):
 
 def readStatsFile(statsFile):
     global stats
-    stats = {}
-    F = open(statsFile)
-    ignores = re.compile(r"^---|^$")
-    statLine = re.compile(
-        r"([a-zA-Z0-9_\.:-]+)\s+([-+]?[0-9]+\.[0-9]+|[-+]?[0-9]+|nan|inf)"
-    )
-    count = 0
-    for line in F:
-        # ignore empty lines and lines starting with "---"
-        if not ignores.match(line):
-            count += 1
-            match = statLine.match(line)
-            if match:
-                statKind = match.group(1)
-                statValue = match.group(2)
-                if statValue == "nan":
-                    logging.warning("%s is nan. Setting it to 0" % statKind)
-                    statValue = "0"
-                stats[statKind] = statValue
-            else:
-                logging.warning(
-                    f"Line {count} did not match the expected format: {line.strip()}"
-                )
-    F.close()
+    # values are substituted into the template expressions as strings
+    stats = {
+        statKind: str(statValue)
+        for statKind, statValue in load_stats(statsFile).items()
+    }
+    return stats
 
 
 def readConfigFile(configFile):
@@ -145,6 +136,7 @@ def readConfigFile(configFile):
     config = json.load(F)
     # print(type(config))
     F.close()
+    return config
 
 
 def readMcpatFile(templateFile):
@@ -153,7 +145,8 @@ def readMcpatFile(templateFile):
     # ET.dump(templateMcpat)
 
 
-def prepareTemplate(outputFile):
+def componentCounts():
+    """Return the number of cores, L2s and L3s of the config and whether the L2s are private or shared."""
     numCores = len(config["system"]["cpu"])
     logging.debug("Number of CPU cores: %d" % numCores)
     privateL2 = "l2" in config["system"]["cpu"][0].keys()
@@ -171,6 +164,276 @@ def prepareTemplate(outputFile):
     numL3 = 0  # TODO: complete
 
     logging.debug("Number of L2 caches: %d" % numL2)
+    return numCores, numL2, numL3, privateL2, sharedL2
+
+
+def coreSignature(cpuConfig):
+    """Return a canonical string of the config.json entry of a core, without the fields naming the core."""
+
+    def normalize(value):
+        if isinstance(value, dict):
+            return {
+                key: normalize(item)
+                for key, item in value.items()
+                if key not in CORE_IDENTITY_KEYS
+            }
+        if isinstance(value, list):
+            return [normalize(item) for item in value]
+        if isinstance(value, str):
+            return re.sub(r"cpu\d+", "cpu", value)
+        return value
+
+    return json.dumps(normalize(cpuConfig), sort_keys=True)
+
+
+def averageCoreStats(statsData):
+    """
+    Return the stats with the stats of every core replaced by their average over the cores,
+    the activity of the single core McPAT models for homogeneous cores. Sums over the cores,
+    e.g. the system cycles, are unchanged up to rounding.
+    """
+    perCore = {}
+    for statKind, statValue in statsData.items():
+        match = coreStatPattern.match(statKind)
+        if match:
+            perCore.setdefault(match.group(2), []).append(statValue)
+
+    averages = {}
+    for statKind, values in perCore.items():
+        try:
+            values = [
+                parse_value(value) if isinstance(value, str) else value
+                for value in values
+            ]
+        except ValueError:
+            continue
+        average = sum(values) / len(values)
+        # integral stats stay integral, the template casts them with int()
+        if all(isinstance(value, int) for value in values):
+            average = int(round(average))
+        averages[statKind] = average
+
+    averaged = dict(statsData)
+    for statKind in statsData:
+        match = coreStatPattern.match(statKind)
+        if match and match.group(2) in averages:
+            averaged[statKind] = averages[match.group(2)]
+    return averaged
+
+
+def expandTemplate(homogeneous=False):
+    """
+    Expand the template structure for the config: one core component per core, one L2 component
+    per private L2, and no L2/L3 component when there is none. The structure only depends on
+    config.json, so it is expanded once for all the stats snapshots of a batch.
+
+    homogeneous: model identical cores as one core component with homogeneous_cores=1,
+    the cores are expanded separately if their configs differ
+    """
+    global homogeneousCores, coreSignatures, derivedCoreParams
+    numCores, numL2, numL3, privateL2, sharedL2 = componentCounts()
+    root = templateMcpat.getroot()
+
+    # the parameters derived from the config of a core are computed once per distinct config
+    coreSignatures = [coreSignature(cpu) for cpu in config["system"]["cpu"]]
+    derivedCoreParams = {}
+    identical = len(set(coreSignatures)) == 1
+    homogeneousCores = homogeneous and numCores > 1 and identical
+    if homogeneous and not identical:
+        logging.warning("The cores are not identical, they are modeled separately")
+    numCoreElems = 1 if homogeneousCores else numCores
+
+    if len(root) == 0 or len(root[0]) == 0:
+        logging.error("Template file is empty")
+        sys.exit(1)
+
+    system = root[0][0]
+    for child in list(system):
+        name = child.attrib.get("name")
+        # replace <component id="system.core" name="core"> with <component id="system.core0" name="core0"> ...
+        if name == "core":
+            copies = []
+            for coreCounter in range(numCoreElems):
+                coreElem = copy.deepcopy(child)
+                coreElem.attrib["name"] = "core" + str(coreCounter)
+                coreElem.attrib["id"] = "system.core" + str(coreCounter)
+                copies.append(coreElem)
+        elif (name == "L20" and numL2 == 0) or (name == "L30" and numL3 == 0):
+            copies = []
+        elif name == "L20" and privateL2:
+            copies = []
+            for l2Counter in range(numCoreElems):
+                l2Elem = copy.deepcopy(child)
+                l2Elem.attrib["name"] = "L2" + str(l2Counter)
+                l2Elem.attrib["id"] = "system.L2" + str(l2Counter)
+                # a private L2 refers to the stats and config of its core
+                for l2Child in l2Elem:
+                    childValue = l2Child.attrib.get("value")
+                    if (
+                        isinstance(childValue, str)
+                        and "cpu." in childValue
+                        and "stats" in childValue.split(".")[0]
+                    ):
+                        childValue = childValue.replace(
+                            "cpu.", "cpu" + str(l2Counter) + "."
+                        )
+                    if (
+                        isinstance(childValue, str)
+                        and "cpu." in childValue
+                        and "config" in childValue.split(".")[0]
+                    ):
+                        childValue = childValue.replace(
+                            "cpu.", "cpu." + str(l2Counter) + "."
+                        )
+                    if isinstance(childValue, str):
+                        l2Child.attrib["value"] = childValue
+                copies.append(l2Elem)
+        else:
+            continue
+        index = list(system).index(child)
+        system.remove(child)
+        for i, elem in enumerate(copies):
+            system.insert(index + i, elem)
+
+
+def computeCoreParams(cpuConfig):
+    """
+    Compute the parameters of a core derived from its config.json entry: the FU counts and
+    duty cycles from its FU pool and the pipeline depth from its stage delays.
+    """
+    IFUDutyCycle = 0
+    LSUDutyCycle = 0
+    IntDutyCycle = 0
+    MULDutyCycle = 0
+    FPUDutyCycle = 0
+    ALUPerCore = 0
+    MULPerCore = 0
+    FPUPerCore = 0
+    for FU in cpuConfig["fuPool"]["FUList"]:
+        for OP in FU["opList"]:
+            if OP["opClass"] == "IntAlu":
+                ALUPerCore += float(FU["count"] / len(FU["opList"]))
+            if OP["opClass"] == "IprAccess":
+                if OP["pipelined"] == False:
+                    IFUDutyCycle += float(1 / (OP["opLat"])) / len(
+                        FU["opList"]
+                    )
+                    logging.debug("IFU Duty Cycle: %f" % IFUDutyCycle)
+                else:
+                    IFUDutyCycle += float(1) / len(FU["opList"])
+
+                    logging.debug("IFU Duty Cycle: %f" % IFUDutyCycle)
+            if (
+                OP["opClass"] == "MemRead"
+                or OP["opClass"] == "MemWrite"
+                or OP["opClass"] == "FloatMemRead"
+                or OP["opClass"] == "FloatMemWrite"
+            ):
+                if OP["pipelined"] == False:
+                    LSUDutyCycle += float(1 / (OP["opLat"])) / 4
+                else:
+                    LSUDutyCycle += float(1) / 4
+                LSUDutyCycle = min(LSUDutyCycle, float(1))
+                logging.debug("LSU Duty Cycle: %f" % LSUDutyCycle)
+            if OP["opClass"] == "IntAlu":
+                if OP["pipelined"] == False:
+                    IntDutyCycle += float(1 / (OP["opLat"])) / len(
+                        FU["opList"]
+                    )
+                else:
+                    IntDutyCycle += float(1) / len(FU["opList"])
+                logging.debug("ALU Duty Cycle: %f" % IntDutyCycle)
+            if OP["opClass"] == "IntMult" or OP["opClass"] == "IntDiv":
+                MULPerCore += float(FU["count"] / len(FU["opList"]))
+                if OP["pipelined"] == False:
+                    MULDutyCycle += float(1 / (OP["opLat"])) / 2
+                else:
+                    MULDutyCycle += float(1) / 2
+                logging.debug("Mult Duty Cycle: %f" % MULDutyCycle)
+            if (
+                OP["opClass"] == "FloatAdd"
+                or OP["opClass"] == "FloatCmp"
+                or OP["opClass"] == "FloatCvt"
+                or OP["opClass"] == "FloatMult"
+                or OP["opClass"] == "FloatDiv"
+                or OP["opClass"] == "FloatSqrt"
+                or OP["opClass"] == "FloatMultAcc"
+                or OP["opClass"] == "FloatMisc"
+            ):
+                FPUPerCore += float(FU["count"] / len(FU["opList"]))
+                if OP["pipelined"] == False:
+                    FPUDutyCycle += float(1 / (OP["opLat"])) / 8
+                else:
+                    FPUDutyCycle += float(1) / 8
+                logging.debug("FPU Duty Cycle: %f" % FPUDutyCycle)
+
+    MemManUIDutyCycle = IFUDutyCycle
+    MemManUDDutyeCycle = LSUDutyCycle
+
+    archType = cpuConfig["isa"][0]["type"][:3]
+    logging.debug("Arch type: %s" % archType)
+    if archType == "X86":
+        INT_EXE = 2
+        FP_EXE = 8
+    elif archType == "ARM":
+        INT_EXE = 3
+        FP_EXE = 7
+    else:
+        INT_EXE = 3
+        FP_EXE = 6
+    try:
+        base = (
+            cpuConfig["fetchToDecodeDelay"]
+            + cpuConfig["decodeToRenameDelay"]
+            + cpuConfig["renameToIEWDelay"]
+            + cpuConfig["iewToCommitDelay"]
+        )
+        maxBase = max(
+            base,
+            cpuConfig["commitToDecodeDelay"],
+            cpuConfig["commitToFetchDelay"],
+            cpuConfig["commitToIEWDelay"],
+            cpuConfig["commitToRenameDelay"],
+        )
+        pipelineDepth = (
+            str(INT_EXE + base + maxBase) + "," + str(FP_EXE + base + maxBase)
+        )
+        logging.debug("Pipeline depth: %s" % pipelineDepth)
+    except KeyError:
+        pipelineDepth = None
+
+    return {
+        "IFUDutyCycle": IFUDutyCycle,
+        "LSUDutyCycle": LSUDutyCycle,
+        "IntDutyCycle": IntDutyCycle,
+        "MULDutyCycle": MULDutyCycle,
+        "FPUDutyCycle": FPUDutyCycle,
+        "MemManUIDutyCycle": MemManUIDutyCycle,
+        "MemManUDDutyeCycle": MemManUDDutyeCycle,
+        "ALUPerCore": ALUPerCore,
+        "MULPerCore": MULPerCore,
+        "FPUPerCore": FPUPerCore,
+        "pipelineDepth": pipelineDepth,
+    }
+
+
+def coreParams(coreCounter):
+    """Return the derived parameters of a core, computed once for all the cores sharing its config."""
+    signature = coreSignatures[coreCounter]
+    if signature not in derivedCoreParams:
+        derivedCoreParams[signature] = computeCoreParams(
+            config["system"]["cpu"][coreCounter]
+        )
+    return derivedCoreParams[signature]
+
+def prepareTemplate(outputFile, homogeneous=False):
+    expandTemplate(homogeneous)
+    fillTemplate()
+
+
+def fillTemplate():
+    """Fill the values of an expanded template from config and stats."""
+    numCores, numL2, numL3, privateL2, sharedL2 = componentCounts()
 
     targetCoreClockrate = int(
         10**6 / config["system"]["cpu_clk_domain"]["clock"][0]
@@ -212,18 +475,9 @@ def prepareTemplate(outputFile):
     logging.debug("Total cycles: %d" % totalCycles)
     logging.debug("Idle cycles: %d" % idleCycles)
 
-    elemCounter = 0
     root = templateMcpat.getroot()
 
-    if len(root) == 0 or len(root[0]) == 0:
-        logging.error("Template file is empty")
-        sys.exit(1)
-
-    children_to_remove = []
-
     for child in root[0][0]:
-        elemCounter += 1  # to add elements in correct sequence
-
         if child.attrib.get("name") == "number_of_cores":
             child.attrib["value"] = str(numCores)
         if child.attrib.get("name") == "number_of_L2s":
@@ -236,6 +490,11 @@ def prepareTemplate(outputFile):
             else:
                 Private_L2 = str(1)
             child.attrib["value"] = Private_L2
+        if child.attrib.get("name") == "homogeneous_cores":
+            child.attrib["value"] = str(int(homogeneousCores))
+        # private L2s are aggregated with their cores
+        if child.attrib.get("name") == "homogeneous_L2s" and privateL2:
+            child.attrib["value"] = str(int(homogeneousCores))
         if child.attrib.get("name") == "total_cycles":
             child.attrib["value"] = str(totalCycles)
         if child.attrib.get("name") == "idle_cycles":
@@ -247,100 +506,13 @@ def prepareTemplate(outputFile):
 
         temp = child.attrib.get("value")
 
-        # start with <component id="system.core0" name="core0">
-        # remove a core template element and replace it with number of cores template elements
-        if child.attrib.get("name") == "core":
-            coreElem = copy.deepcopy(child)
+        # the cores are filled together, starting with <component id="system.core0" name="core0">
+        if child.attrib.get("id") == "system.core0":
+            systemElems = {elem.attrib.get("id"): elem for elem in root[0][0]}
+            for coreCounter in range(1 if homogeneousCores else numCores):
+                coreElem = systemElems["system.core" + str(coreCounter)]
 
-            coreElemCopy = copy.deepcopy(coreElem)
-            for coreCounter in range(numCores):
-                coreElem.attrib["name"] = "core" + str(coreCounter)
-                coreElem.attrib["id"] = "system.core" + str(coreCounter)
-
-                IFUDutyCycle = 0
-                LSUDutyCycle = 0
-                IntDutyCycle = 0
-                MULDutyCycle = 0
-                FPUDutyCycle = 0
-                LSUCnt = 0
-                ALUPerCore = 0
-                MULPerCore = 0
-                FPUPerCore = 0
-                for FU in config["system"]["cpu"][coreCounter]["fuPool"][
-                    "FUList"
-                ]:
-                    for OP in FU["opList"]:
-                        if OP["opClass"] == "IntAlu":
-                            ALUPerCore += float(
-                                FU["count"] / len(FU["opList"])
-                            )
-                        if OP["opClass"] == "IprAccess":
-                            if OP["pipelined"] == False:
-                                IFUDutyCycle += float(1 / (OP["opLat"])) / len(
-                                    FU["opList"]
-                                )
-                                logging.debug(
-                                    "IFU Duty Cycle: %f" % IFUDutyCycle
-                                )
-                            else:
-                                IFUDutyCycle += float(1) / len(FU["opList"])
-
-                                logging.debug(
-                                    "IFU Duty Cycle: %f" % IFUDutyCycle
-                                )
-                        if (
-                            OP["opClass"] == "MemRead"
-                            or OP["opClass"] == "MemWrite"
-                            or OP["opClass"] == "FloatMemRead"
-                            or OP["opClass"] == "FloatMemWrite"
-                        ):
-                            if OP["pipelined"] == False:
-                                LSUDutyCycle += float(1 / (OP["opLat"])) / 4
-                            else:
-                                LSUDutyCycle += float(1) / 4
-                            LSUDutyCycle = min(LSUDutyCycle, float(1))
-                            logging.debug("LSU Duty Cycle: %f" % LSUDutyCycle)
-                        if OP["opClass"] == "IntAlu":
-                            if OP["pipelined"] == False:
-                                IntDutyCycle += float(1 / (OP["opLat"])) / len(
-                                    FU["opList"]
-                                )
-                            else:
-                                IntDutyCycle += float(1) / len(FU["opList"])
-                            logging.debug("ALU Duty Cycle: %f" % IntDutyCycle)
-                        if (
-                            OP["opClass"] == "IntMult"
-                            or OP["opClass"] == "IntDiv"
-                        ):
-                            MULPerCore += float(
-                                FU["count"] / len(FU["opList"])
-                            )
-                            if OP["pipelined"] == False:
-                                MULDutyCycle += float(1 / (OP["opLat"])) / 2
-                            else:
-                                MULDutyCycle += float(1) / 2
-                            logging.debug("Mult Duty Cycle: %f" % MULDutyCycle)
-                        if (
-                            OP["opClass"] == "FloatAdd"
-                            or OP["opClass"] == "FloatCmp"
-                            or OP["opClass"] == "FloatCvt"
-                            or OP["opClass"] == "FloatMult"
-                            or OP["opClass"] == "FloatDiv"
-                            or OP["opClass"] == "FloatSqrt"
-                            or OP["opClass"] == "FloatMultAcc"
-                            or OP["opClass"] == "FloatMisc"
-                        ):
-                            FPUPerCore += float(
-                                FU["count"] / len(FU["opList"])
-                            )
-                            if OP["pipelined"] == False:
-                                FPUDutyCycle += float(1 / (OP["opLat"])) / 8
-                            else:
-                                FPUDutyCycle += float(1) / 8
-                            logging.debug("FPU Duty Cycle: %f" % FPUDutyCycle)
-
-                MemManUIDutyCycle = IFUDutyCycle
-                MemManUDDutyeCycle = LSUDutyCycle
+                params = coreParams(coreCounter)
 
                 for coreChild in coreElem:
                     childId = coreChild.attrib.get("id")
@@ -377,61 +549,13 @@ def prepareTemplate(outputFile):
                             childValue = "1"
                         else:
                             childValue = "0"
-                        archType = config["system"]["cpu"][coreCounter]["isa"][
-                            0
-                        ]["type"][:3]
-                        logging.debug("Arch type: %s" % archType)
-                        if archType == "X86":
-                            INT_EXE = 2
-                            FP_EXE = 8
-                        elif archType == "ARM":
-                            INT_EXE = 3
-                            FP_EXE = 7
-                        else:
-                            INT_EXE = 3
-                            FP_EXE = 6
                     if (
                         isinstance(childName, str)
                         and childName == "pipeline_depth"
                     ):
-                        try:
-                            base = (
-                                config["system"]["cpu"][coreCounter][
-                                    "fetchToDecodeDelay"
-                                ]
-                                + config["system"]["cpu"][coreCounter][
-                                    "decodeToRenameDelay"
-                                ]
-                                + config["system"]["cpu"][coreCounter][
-                                    "renameToIEWDelay"
-                                ]
-                                + config["system"]["cpu"][coreCounter][
-                                    "iewToCommitDelay"
-                                ]
-                            )
-                            cToDecode = config["system"]["cpu"][coreCounter][
-                                "commitToDecodeDelay"
-                            ]
-                            cToFetch = config["system"]["cpu"][coreCounter][
-                                "commitToFetchDelay"
-                            ]
-                            cToIew = config["system"]["cpu"][coreCounter][
-                                "commitToIEWDelay"
-                            ]
-                            cToRename = config["system"]["cpu"][coreCounter][
-                                "commitToRenameDelay"
-                            ]
-                            maxBase = max(
-                                base, cToDecode, cToFetch, cToIew, cToRename
-                            )
-                            pipelineDepth = (
-                                str(INT_EXE + base + maxBase)
-                                + ","
-                                + str(FP_EXE + base + maxBase)
-                            )
-                            logging.debug("Pipeline depth: %s" % pipelineDepth)
-                            childValue = pipelineDepth
-                        except KeyError:
+                        if params["pipelineDepth"] is not None:
+                            childValue = params["pipelineDepth"]
+                        else:
                             logging.warning(
                                 "No pipeline depth found in config"
                             )
@@ -439,19 +563,19 @@ def prepareTemplate(outputFile):
                         isinstance(childName, str)
                         and childName == "ALU_per_core"
                     ):
-                        childValue = str(int(ALUPerCore))
+                        childValue = str(int(params["ALUPerCore"]))
                         logging.debug("ALU per core: %s" % childValue)
                     if (
                         isinstance(childName, str)
                         and childName == "MUL_per_core"
                     ):
-                        childValue = str(int(MULPerCore))
+                        childValue = str(int(params["MULPerCore"]))
                         logging.debug("MUL per core: %s" % childValue)
                     if (
                         isinstance(childName, str)
                         and childName == "FPU_per_core"
                     ):
-                        childValue = str(int(FPUPerCore))
+                        childValue = str(int(params["FPUPerCore"]))
                         logging.debug("FPU per core: %s" % childValue)
                     if (
                         isinstance(childName, str)
@@ -1441,43 +1565,43 @@ def prepareTemplate(outputFile):
                     # if (isinstance(childName, str)) and (
                     #     childName == "IFU_duty_cycle"
                     # ):
-                    #     childValue = str(IFUDutyCycle)
+                    #     childValue = str(params["IFUDutyCycle"])
                     # if (isinstance(childName, str)) and (
                     #     childName == "LSU_duty_cycle"
                     # ):
-                    #     childValue = str(LSUDutyCycle)
+                    #     childValue = str(params["LSUDutyCycle"])
                     # if (isinstance(childName, str)) and (
                     #     childName == "MemManU_I_duty_cycle"
                     # ):
-                    #     childValue = str(MemManUIDutyCycle)
+                    #     childValue = str(params["MemManUIDutyCycle"])
                     # if (isinstance(childName, str)) and (
                     #     childName == "MemManU_D_duty_cycle"
                     # ):
-                    #     childValue = str(MemManUDDutyeCycle)
+                    #     childValue = str(params["MemManUDDutyeCycle"])
                     # if (isinstance(childName, str)) and (
                     #     childName == "ALU_duty_cycle"
                     # ):
-                    #     childValue = str(IntDutyCycle)
+                    #     childValue = str(params["IntDutyCycle"])
                     # if (isinstance(childName, str)) and (
                     #     childName == "MUL_duty_cycle"
                     # ):
-                    #     childValue = str(MULDutyCycle)
+                    #     childValue = str(params["MULDutyCycle"])
                     # if (isinstance(childName, str)) and (
                     #     childName == "FPU_duty_cycle"
                     # ):
-                    #     childValue = str(FPUDutyCycle)
+                    #     childValue = str(params["FPUDutyCycle"])
                     # if (isinstance(childName, str)) and (
                     #     childName == "ALU_cdb_duty_cycle"
                     # ):
-                    #     childValue = str(IntDutyCycle)
+                    #     childValue = str(params["IntDutyCycle"])
                     # if (isinstance(childName, str)) and (
                     #     childName == "MUL_cdb_duty_cycle"
                     # ):
-                    #     childValue = str(MULDutyCycle)
+                    #     childValue = str(params["MULDutyCycle"])
                     # if (isinstance(childName, str)) and (
                     #     childName == "FPU_cdb_duty_cycle"
                     # ):
-                    #     childValue = str(FPUDutyCycle)
+                    #     childValue = str(params["FPUDutyCycle"])
 
                     # replace name
                     if isinstance(childId, str) and "core" in childId:
@@ -2381,47 +2505,10 @@ def prepareTemplate(outputFile):
                         coreChild.attrib["id"] = childId
                     if isinstance(childValue, str):
                         coreChild.attrib["value"] = childValue
-                root[0][0].insert(elemCounter, coreElem)
-                coreElem = copy.deepcopy(coreElemCopy)
-                elemCounter += 1
-            root[0][0].remove(child)
-            elemCounter -= 1
 
+        # private L2s only refer to per core stats, they are complete once expanded
         if child.attrib.get("name") == "L20":
-            if numL2 == 0:
-                children_to_remove.append(child)
-
-            elif privateL2:
-                l2Elem = copy.deepcopy(child)
-                l2ElemCopy = copy.deepcopy(l2Elem)
-                for l2Counter in range(numL2):
-                    l2Elem.attrib["name"] = "L2" + str(l2Counter)
-                    l2Elem.attrib["id"] = "system.L2" + str(l2Counter)
-                    for l2Child in l2Elem:
-                        childValue = l2Child.attrib.get("value")
-                        if (
-                            isinstance(childValue, str)
-                            and "cpu." in childValue
-                            and "stats" in childValue.split(".")[0]
-                        ):
-                            childValue = childValue.replace(
-                                "cpu.", "cpu" + str(l2Counter) + "."
-                            )
-                        if (
-                            isinstance(childValue, str)
-                            and "cpu." in childValue
-                            and "config" in childValue.split(".")[0]
-                        ):
-                            childValue = childValue.replace(
-                                "cpu.", "cpu." + str(l2Counter) + "."
-                            )
-                        if isinstance(childValue, str):
-                            l2Child.attrib["value"] = childValue
-                    root[0][0].insert(elemCounter, l2Elem)
-                    l2Elem = copy.deepcopy(l2ElemCopy)
-                    elemCounter += 1
-                root[0][0].remove(child)
-            else:
+            if not privateL2:
                 child.attrib["name"] = "L20"
                 child.attrib["id"] = "system.L20"
                 for l2Child in child:
@@ -2648,11 +2735,6 @@ def prepareTemplate(outputFile):
 
                     l2Child.attrib["value"] = childValue
 
-        if child.attrib.get("name") == "L30":
-            # TODO: complete here.
-            if numL3 == 0:
-                children_to_remove.append(child)
-
         if child.attrib.get("name") == "mc":
             for mcChild in child:
                 mcChildValue = mcChild.attrib.get("value")
@@ -2722,136 +2804,131 @@ def prepareTemplate(outputFile):
 
                 mcChild.attrib["value"] = mcChildValue
 
-    logging.debug("Removing %d number of children" % len(children_to_remove))
-    for child in children_to_remove:
-        root[0][0].remove(child)
-
-    prettify(root)
-    # templateMcpat.write(outputFile)
-
-
-# for stats.txt?
-def getConfValue(confStr):
-    spltConf = re.split(r"\.", confStr)
-    currConf = config
-    currHierarchy = ""
-    for x in spltConf:
-        currHierarchy += x
-        if x.isdigit():
-            currConf = currConf[int(x)]
-        elif x in currConf:
-            # if isinstance(currConf, types.ListType):
-            #     #this is mostly for system.cpu* as system.cpu is an array
-            #     #This could be made better
-            #     if x not in currConf[0]:
-            #         print "%s does not exist in config" % currHierarchy
-            #     else:
-            #         currConf = currConf[0][x]
-            # else:
-            #         print "***WARNING: %s does not exist in config.***" % currHierarchy
-            #         print "\t Please use the right config param in your McPAT template file"
-            # else:
-            currConf = currConf[x]
-        currHierarchy += "."
-
-    logging.info(confStr, currConf)
-
-    return currConf
+
+def lookupStat(statName):
+    """Return the stats.txt value of a template reference, None if it does not exist."""
+    if statName in stats:
+        return stats[statName]
+    # single core runs name the core system.cpu instead of system.cpu0
+    if ".cpu0." in statName and statName.replace(".cpu0.", ".cpu.") in stats:
+        return stats[statName.replace(".cpu0.", ".cpu.")]
+    logging.warning(
+        statName
+        + " does not exist in stats"
+        + "\n\t Maybe invalid stat in McPAT template file"
+    )
+    return None
+
+
+def lookupConf(confStr):
+    """Return the config.json value of a template reference, None if it does not exist."""
+    try:
+        return configIndex.get(confStr)
+    except ConfigKeyError as err:
+        logging.error(str(err))
+        return None
 
 
 def dumpMcpatOut(outFile):
     """
-    outfile: file reference to "mcpat-in.xml"
+    outfile: file reference or path to "mcpat-in.xml"
     """
 
     rootElem = templateMcpat.getroot()
-    configMatch = re.compile(r"config\.([][a-zA-Z0-9_:\.]+)")
 
     # replace params with values from the GEM5 config file
     for param in rootElem.iter("param"):
-        name = param.attrib["name"]
-        value = param.attrib["value"]
-
-        # if there is a config in this attrib
-        if "config" in value:
-            allConfs = configMatch.findall(value)
+        expr = compile_value(param.attrib["value"], "config")
+        if expr is not None:
+            value = expr.evaluate(lookupConf)
+            if value is None:
+                logging.error(
+                    "Cannot evaluate "
+                    + param.attrib["value"]
+                    + "\n\t set correct key string in template value"
+                )
+                raise ValueError("Unresolved template value " + param.attrib["value"])
+            param.attrib["value"] = value
 
-            for conf in allConfs:
+    # replace stats with values from the GEM5 stats file,
+    # expressions with a missing stat keep their template value
+    for stat in rootElem.iter("stat"):
+        expr = compile_value(stat.attrib["value"], "stats")
+        if expr is not None:
+            value = expr.evaluate(lookupStat)
+            if value is not None:
+                stat.attrib["value"] = value
 
-                confValue = getConfValue(conf)
-                value = re.sub("config." + conf, str(confValue), value)
+    # Write out the xml file, ElementTree.write serializes the tree straight to it
+    templateMcpat.write(outFile if isinstance(outFile, str) else outFile.name)
 
-            if "," in value:
-                exprs = re.split(",", value)
-                for i in range(len(exprs)):
-                    try:
-                        exprs[i] = str(eval(exprs[i]))
-                    except Exception as e:
-                        logging.error(
-                            "Possibly "
-                            + conf
-                            + " does not exist in config"
-                            + "\n\t set correct key string in template value"
-                        )
-                        raise
 
-                param.attrib["value"] = ",".join(exprs)
-            else:
-                param.attrib["value"] = str(eval(str(value)))
+def genMcpatXml(configData, statsData, templateFile, outputFile, homogeneous=False):
+    """
+    Generate the McPAT input from an already parsed gem5 config.json and stats.txt.
 
-    # replace stats with values from the GEM5 stats file
-    statRe = re.compile(r"stats\.([a-zA-Z0-9_:\.]+)")
-    for stat in rootElem.iter("stat"):
-        name = stat.attrib["name"]
-        value = stat.attrib["value"]
-        if "stats" in value:
-            allStats = statRe.findall(value)
-            expr = value
-            for i in range(len(allStats)):
-                # print(allStats[i])
-                if allStats[i] in stats:
-
-                    expr = re.sub(
-                        "stats.%s" % allStats[i], stats[allStats[i]], expr
-                    )
-                elif ".cpu0." in allStats[i]:
-                    try:
-                        cpu_stat = allStats[i].replace(".cpu0.", ".cpu.")
-                        expr = re.sub(
-                            "stats.%s" % allStats[i], stats[cpu_stat], expr
-                        )
-                    except KeyError:
-                        logging.warning(
-                            allStats[i]
-                            + " does not exist in stats"
-                            + "\n\t Maybe invalid stat in McPAT template file"
-                        )
-                else:
-                    # expr = re.sub('stats.%s' % allStats[i], str(1), expr)
-                    logging.warning(
-                        allStats[i]
-                        + " does not exist in stats"
-                        + "\n\t Maybe invalid stat in McPAT template file"
-                    )
+    configData: dict loaded from config.json or utils.gem5_config.Gem5Config
+    statsData: dict of stat name to value, as returned by readStatsFile or utils.stats.load_stats
+    templateFile: path to the McPAT template XML
+    outputFile: path to the generated McPAT input XML
+    homogeneous: model identical cores as one core with their average stats, see expandTemplate
+    """
+    for _ in genMcpatXmls(
+        configData, [statsData], templateFile, [outputFile], homogeneous
+    ):
+        pass
 
-            if "config" not in expr and "stats" not in expr:
-                stat.attrib["value"] = str(eval(expr))
 
-    # Write out the xml file
-    templateMcpat.write(outFile.name)
+def genMcpatXmls(
+    configData, statsSnapshots, templateFile, outputFiles, homogeneous=False
+):
+    """
+    Generate one McPAT input per stats snapshot sharing a gem5 config.json, e.g. the stats dumps
+    of one run. The template is parsed and expanded for the config once, every snapshot only
+    refills the values of the expanded template.
+
+    configData: dict loaded from config.json or utils.gem5_config.Gem5Config
+    statsSnapshots: iterable of dicts of stat name to value
+    templateFile: path to the McPAT template XML
+    outputFiles: iterable of paths to the generated McPAT input XMLs, one per snapshot
+    homogeneous: model identical cores as one core with their average stats, see expandTemplate
+    yields: the path of every McPAT input once it is written
+    """
+    global config, configIndex, stats
+    # template references are looked up in the path index, the fill code walks the tree
+    configIndex = as_config(configData)
+    config = configIndex.config
+    readMcpatFile(templateFile)
+    expandTemplate(homogeneous)
+    # attributes of the expanded template, restored before every snapshot is filled in
+    skeleton = [(elem, dict(elem.attrib)) for elem in templateMcpat.getroot().iter()]
+
+    for statsData, outputFile in zip(statsSnapshots, outputFiles):
+        for elem, attrib in skeleton:
+            elem.attrib.clear()
+            elem.attrib.update(attrib)
+        if homogeneousCores:
+            statsData = averageCoreStats(statsData)
+        stats = {
+            statKind: str(statValue) for statKind, statValue in statsData.items()
+        }
+        fillTemplate()
+        dumpMcpatOut(outputFile)
+        yield outputFile
 
 
 def main():
     global args
     parser = create_parser()
     args = parser.parse_args()
-    readStatsFile(args.stats)
-    readConfigFile(args.config)
-    readMcpatFile(args.template)
 
-    prepareTemplate(args.output)
-
-    dumpMcpatOut(args.output)
+    genMcpatXml(
+        readConfigFile(args.config),
+        readStatsFile(args.stats),
+        args.template,
+        args.output.name,
+        args.homogeneous,
+    )
 
 
 if __name__ == "__main__":
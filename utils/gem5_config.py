@@ -0,0 +1,94 @@
+import json
+import difflib
+
+# gem5's config.json is a tree of dicts and lists. Its values are referred to by dotted paths,
+# list entries by their index, e.g. system.cpu.3.fuPool.FUList.0.count or system.cpu[3].numThreads.
+# The tree is flattened once into a path to value index on the first lookup, so that every
+# reference of a McPAT template or of the memory power model is a single dict lookup instead of
+# a walk from the root.
+
+class ConfigKeyError(KeyError):
+    # A path that does not exist in config.json, the message tells where the path leaves the tree
+    def __str__(self):
+        return self.args[0]
+
+def split_path(path):
+    # @path: str, dotted path, list indices may be written as [i]
+    # return: list of str, the components of the path
+    return [part for part in path.replace('[', '.').replace(']', '').split('.') if part]
+
+class Gem5Config:
+    # Path-indexed view of a parsed config.json
+    # @config: dict, loaded from config.json
+
+    def __init__(self, config):
+        self.config = config
+        self.index = None
+        self.lookups = {}
+
+    def flatten(self):
+        # return: dict<'a.b.0.c', value> of every node of the tree, the inner dicts and lists included
+        index = {}
+        nodes = [('', self.config)]
+        while nodes:
+            path, node = nodes.pop()
+            if isinstance(node, dict):
+                items = node.items()
+            elif isinstance(node, list):
+                items = enumerate(node)
+            else:
+                continue
+            for key, value in items:
+                child = path + '.' + str(key) if path else str(key)
+                index[child] = value
+                nodes.append((child, value))
+        return index
+
+    def get(self, path):
+        # @path: str, dotted path of a config.json value, e.g. system.cpu.0.issueWidth
+        # return: the value at path, a dict or list for inner nodes
+        # raise: ConfigKeyError if the path does not exist
+
+        if path in self.lookups:
+            return self.lookups[path]
+        # concurrent stages may flatten the same config twice, both indexes are identical
+        if self.index is None:
+            self.index = self.flatten()
+        key = '.'.join(split_path(path))
+        if key not in self.index:
+            raise ConfigKeyError(self.diagnose(path))
+        value = self.index[key]
+        self.lookups[path] = value
+        return value
+
+    def diagnose(self, path):
+        # return: str, why path does not exist, naming the first component that leaves the tree
+        node = self.config
+        walked = []
+        for part in split_path(path):
+            where = '.'.join(walked) or 'the root'
+            if isinstance(node, dict):
+                if part not in node:
+                    close = difflib.get_close_matches(part, [str(key) for key in node], n=3)
+                    hint = ', did you mean ' + ' or '.join(close) + '?' if close else ''
+                    return "config.json has no %s: %s has no key '%s'%s" % (path, where, part, hint)
+                node = node[part]
+            elif isinstance(node, list):
+                if not part.isdigit() or int(part) >= len(node):
+                    return "config.json has no %s: %s is a list of %d entries, '%s' is not an index of it" % (path, where, len(node), part)
+                node = node[int(part)]
+            else:
+                return "config.json has no %s: %s is the value %r, it has no '%s'" % (path, where, node, part)
+            walked.append(part)
+        return "config.json has no " + path
+
+def as_config(config):
+    # @config: dict loaded from config.json or Gem5Config
+    # return: Gem5Config
+    return config if isinstance(config, Gem5Config) else Gem5Config(config)
+
+def load_config(config_file):
+    # @config_file: path to a gem5 config.json
+    # return: Gem5Config
+    with open(config_file) as f:
+        return Gem5Config(json.load(f))
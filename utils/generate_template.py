@@ -359,33 +359,24 @@ xml_template_end = """
 
 xml_template_customized = """"""
 
-parser = argparse.ArgumentParser(
-    description="A script to generate McPAT template for a given configuration",
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-)
-parser.add_argument(
-    "--customize_component_config",
-    "-cc",
-    type=str,
-    required=False,
-    help="Customized module name",
-)
 
-output_file = "template_parser.xml"
-
-args = parser.parse_args()
-if args.customize_component_config:
-    with open(args.customize_component_config, "r") as f:
-        data = yaml.safe_load(f)
-        component_name = data["component_name"]
-        component_id = "system." + component_name
-        static_ = data["static"]
-        switch_ = data["switch"]
-        frequency_ = data["frequency"]
-        activation_factor_ = data["activation_factor"]
-        switch_count_ = data["switch_count"]
-        interval_ = data["interval"]
-        xml_template_customized = f"""
+def generate_template(output_file, customize_component_config=None):
+    # Write the McPAT template used by gem52mcpat_parser
+    # @output_file: path to the generated template
+    # @customize_component_config: path to a yaml file describing a customized component, optional
+    xml_customized = xml_template_customized
+    if customize_component_config:
+        with open(customize_component_config, "r") as f:
+            data = yaml.safe_load(f)
+            component_name = data["component_name"]
+            component_id = "system." + component_name
+            static_ = data["static"]
+            switch_ = data["switch"]
+            frequency_ = data["frequency"]
+            activation_factor_ = data["activation_factor"]
+            switch_count_ = data["switch_count"]
+            interval_ = data["interval"]
+            xml_customized = f"""
         <component id="{component_id}" name="{component_name}">
             <param name="static" value="{static_}"/>
             <param name="switch" value="{switch_}"/>
@@ -395,16 +386,44 @@ if args.customize_component_config:
             <stat name="interval" value="{interval_}"/>
         </component>"""
 
+    xml_template = (
+        xml_template_root
+        + xml_template_system
+        + xml_customized
+        + xml_template_end
+    )
+
+    with open(output_file, "w") as f:
+        f.write(xml_template)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="A script to generate McPAT template for a given configuration",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--customize_component_config",
+        "-cc",
+        type=str,
+        required=False,
+        help="Customized module name",
+    )
+    parser.add_argument(
+        "--output-file",
+        "-o",
+        type=str,
+        required=False,
+        help="Output template file (default: template_parser.xml next to this script)",
+    )
+
+    output_file = "template_parser.xml"
 
-xml_template = (
-    xml_template_root
-    + xml_template_system
-    + xml_template_customized
-    + xml_template_end
-)
+    args = parser.parse_args()
 
-script_dir = os.path.dirname(os.path.abspath(__file__))
-file_path = os.path.join(script_dir, output_file)
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    file_path = os.path.join(script_dir, output_file)
+    if args.output_file:
+        file_path = args.output_file
 
-with open(file_path, "w") as f:
-    f.write(xml_template)
+    generate_template(file_path, args.customize_component_config)
@@ -1,47 +1,37 @@
-import json
-import re
 import argparse
 
+try:
+  from utils.stats import load_stats, iter_timed_epochs
+  from utils.gem5_config import as_config, load_config
+except ImportError:  # run as a script from the utils directory
+  from stats import load_stats, iter_timed_epochs
+  from gem5_config import as_config, load_config
+
 class mem_power:
-  def __init__(self, config_file, stats_file, cacti_out, output_file):
+  def __init__(self, config_file, stats_file, cacti_out, output_file, gem5_config=None, gem5_stats=None, epochs=False, bank_leakage=None):
+    # @config_file: gem5 output config.json file, not read if gem5_config is given
+    # @stats_file: gem5 output stats.txt file, not read if gem5_stats is given
+    # @cacti_out: cacti output file
+    # @output_file: output filename of generated mem power trace file
+    # @gem5_config: already parsed config.json, dict or utils.gem5_config.Gem5Config
+    # @gem5_stats: already parsed stats.txt, dict of stat name to value in file order
+    # @epochs: output one power trace row per stats dump in stats_file instead of a single row
+    # @bank_leakage: list of leakage power per bank, overriding the one of cacti_out, e.g. for banks at different temperatures
     # read config data from gem5 config file
-    F = open(config_file)
-    gem5_config = json.load(F)
-    self.num_bank = int(gem5_config['system']['mem_ctrls'][0]['dram']['banks_per_rank']) * int(gem5_config['system']['mem_ctrls'][0]['dram']['ranks_per_channel'])
-    self.burst_length = int(gem5_config['system']['mem_ctrls'][0]['dram']['burst_length'])
-    F.close()
+    if gem5_config is None:
+      gem5_config = load_config(config_file)
+    gem5_config = as_config(gem5_config)
+    self.num_bank = dram_bank_count(gem5_config)
+    self.burst_length = int(gem5_config.get('system.mem_ctrls.0.dram.burst_length'))
 
-    # initiate the access rates for each bank
-    self.access_rates_rd = [0 for number in range(self.num_bank)]
-    self.access_rates_wr = [0 for number in range(self.num_bank)]
+    self.stats_file = stats_file
+    self.epochs = epochs
+    if not epochs:
+      # read stats data from gem5 stats file
+      if gem5_stats is None:
+        gem5_stats = load_stats(stats_file)
+      self.access_rates_rd, self.access_rates_wr, self.sampling_interval = self.read_access_rates(gem5_stats)
 
-    # read stats data from gem5 stats file
-    F = open(stats_file)
-    ignores = re.compile(r'^---|^$')
-    gem5_stats = re.compile(r'([a-zA-Z0-9_\.:-]+)\s+([-+]?[0-9]+\.[0-9]+|[-+]?[0-9]+|nan|inf)')
-    bank_idx_rd = 0
-    bank_idx_wr = 0
-    for line in F:
-        if not ignores.match(line):
-            # obtain the stats name and corresponding value
-            try:
-              stat_key = gem5_stats.match(line).group(1)
-              stat_val = gem5_stats.match(line).group(2)
-            except Exception as e:
-              continue
-            if 'perBankRdBursts' in stat_key:
-              self.access_rates_rd[bank_idx_rd] = int(stat_val)
-              bank_idx_rd += 1
-            elif 'perBankWrBursts' in stat_key:
-              self.access_rates_wr[bank_idx_wr] = int(stat_val)
-              bank_idx_wr += 1
-            elif 'simSeconds' in stat_key:
-              self.sampling_interval = float(stat_val) * 1e9
-            else:
-              continue
-    F.close()
-
-    print(gem5_stats)
     self.mem_ptrace_file = output_file
 
     # read stats data from cacti output file
@@ -51,6 +41,33 @@ class mem_power:
       self.energy_per_read_access = float(line.strip().split(',')[8]) * self.burst_length
       self.energy_per_write_access = float(line.strip().split(',')[9]) * self.burst_length
       self.leakage_per_bank = float(line.strip().split(',')[10]) 
+    if bank_leakage is None:
+      bank_leakage = [self.leakage_per_bank] * self.num_bank
+    self.bank_leakage = bank_leakage
+
+  def read_access_rates(self, gem5_stats):
+    # @gem5_stats: dict of stat name to value in file order
+    # return: per bank read bursts, per bank write bursts, sampling interval in ns
+    # initiate the access rates for each bank
+    access_rates_rd = [0 for number in range(self.num_bank)]
+    access_rates_wr = [0 for number in range(self.num_bank)]
+    sampling_interval = None
+
+    bank_idx_rd = 0
+    bank_idx_wr = 0
+    for stat_key, stat_val in gem5_stats.items():
+      if 'perBankRdBursts' in stat_key:
+        access_rates_rd[bank_idx_rd] = int(stat_val)
+        bank_idx_rd += 1
+      elif 'perBankWrBursts' in stat_key:
+        access_rates_wr[bank_idx_wr] = int(stat_val)
+        bank_idx_wr += 1
+      elif 'simSeconds' in stat_key:
+        sampling_interval = float(stat_val) * 1e9
+      else:
+        continue
+
+    return access_rates_rd, access_rates_wr, sampling_interval
 
   def gen_mem_ptrace_header(self):
     # return the header of the memory power trace file
@@ -60,14 +77,14 @@ class mem_power:
     
     return mem_ptrace_header
 
-  def calc_access_power_trace(self):
-    # calculate the access power and output the overall mem trace file
+  def calc_bank_power(self, access_rates_rd, access_rates_wr, sampling_interval):
+    # return: one row of the memory power trace
     bank_power_trace = [0 for number in range(self.num_bank)]
     #total power = access_count*energy per access + leakage power 
     #calculate bank power for each bank using access traces
 
     for bank in range(self.num_bank):
-      bank_power_trace[bank] = (self.access_rates_rd[bank] * self.energy_per_read_access + self.access_rates_wr[bank] * self.energy_per_write_access) / self.sampling_interval + self.leakage_per_bank
+      bank_power_trace[bank] = (access_rates_rd[bank] * self.energy_per_read_access + access_rates_wr[bank] * self.energy_per_write_access) / sampling_interval + self.bank_leakage[bank]
       bank_power_trace[bank] = round(bank_power_trace[bank], 3)
 
     power_trace = ''
@@ -75,23 +92,56 @@ class mem_power:
     for bank in range(len(bank_power_trace)):
         power_trace = power_trace + str(bank_power_trace[bank]) + '\t'
 
+    return power_trace
+
+  def calc_access_power_trace(self):
+    # calculate the access power and output the overall mem trace file
     mem_ptrace_header = self.gen_mem_ptrace_header()
     with open("%s" %(self.mem_ptrace_file), "w") as f:
         f.write("%s\n" %(mem_ptrace_header))
-        f.write("%s" %(power_trace))
+        if not self.epochs:
+          f.write("%s" %(self.calc_bank_power(self.access_rates_rd, self.access_rates_wr, self.sampling_interval)))
+        else:
+          # one row per stats dump, streamed so that long traces never sit in memory
+          rows = 0
+          for gem5_stats in iter_timed_epochs(self.stats_file):
+            access_rates_rd, access_rates_wr, sampling_interval = self.read_access_rates(gem5_stats)
+            if rows > 0:
+              f.write("\n")
+            f.write("%s" %(self.calc_bank_power(access_rates_rd, access_rates_wr, sampling_interval)))
+            rows += 1
     f.close()
 
-parser = argparse.ArgumentParser(description='Generate memory power trace')
+def dram_bank_count(gem5_config):
+  # @gem5_config: parsed config.json, dict or utils.gem5_config.Gem5Config
+  # return: number of DRAM banks of the memory power trace
+  gem5_config = as_config(gem5_config)
+  return int(gem5_config.get('system.mem_ctrls.0.dram.banks_per_rank')) * int(gem5_config.get('system.mem_ctrls.0.dram.ranks_per_channel'))
+
+def read_cacti_leakage(cacti_out):
+  # @cacti_out: cacti output file
+  # return: leakage power per bank
+  with open(cacti_out) as f:
+    f.readline()
+    return float(f.readline().strip().split(',')[10])
+
+def gen_mem_ptrace(config_file, stats_file, cacti_out, output_file, gem5_config=None, gem5_stats=None, epochs=False, bank_leakage=None):
+  # Generate the memory power trace, see mem_power for the arguments
+  mem_power_0 = mem_power(config_file, stats_file, cacti_out, output_file, gem5_config, gem5_stats, epochs, bank_leakage)
+  mem_power_0.calc_access_power_trace()
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Generate memory power trace')
 
-parser.add_argument('--gem5-config', type=str, help='gem5 output config.json file')
-parser.add_argument('--gem5-stats', type=str, help='gem5 output stats.txt file')
-parser.add_argument('--cacti-out', type=str, help='cacti output file')
-parser.add_argument('--output-file', type=str, help='output filename of generated mem power trace file', default='mem_power_trace.txt')
+  parser.add_argument('--gem5-config', type=str, help='gem5 output config.json file')
+  parser.add_argument('--gem5-stats', type=str, help='gem5 output stats.txt file')
+  parser.add_argument('--cacti-out', type=str, help='cacti output file')
+  parser.add_argument('--output-file', type=str, help='output filename of generated mem power trace file', default='mem_power_trace.txt')
+  parser.add_argument('--epochs', action='store_true', help='output one row per stats dump instead of a single steady row')
 
-args = parser.parse_args()
-config_file = args.gem5_config
-stats_file = args.gem5_stats
-cacti_out = args.cacti_out
-output_file = args.output_file
-mem_power_0 = mem_power(config_file, stats_file, cacti_out, output_file)
-mem_power_0.calc_access_power_trace()
\ No newline at end of file
+  args = parser.parse_args()
+  config_file = args.gem5_config
+  stats_file = args.gem5_stats
+  cacti_out = args.cacti_out
+  output_file = args.output_file
+  gen_mem_ptrace(config_file, stats_file, cacti_out, output_file, epochs=args.epochs)
\ No newline at end of file
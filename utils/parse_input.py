@@ -5,12 +5,24 @@ import glob
 def parse_input(input_file):
     # @input_file: str, path to the top level yaml input file
 
+    inputs = load_input(input_file)
+    return parse_inputs(inputs, input_file)
+
+def load_input(input_file):
+    # @input_file: str, path to the top level yaml input file
+    # return: dict, raw content of the yaml file
+
     with open(input_file, 'r') as stream:
         try:
             inputs=yaml.safe_load(stream)
         except yaml.YAMLError as exc:
             print(exc)
             exit(1)
+    return inputs
+
+def parse_inputs(inputs, input_file):
+    # @inputs: dict, raw content of a top level yaml input file
+    # @input_file: str, path to the yaml input file, used in error messages
     
     # check existence of required configuration options
     if not inputs.get("arch"):
@@ -81,6 +93,9 @@ def parse_input(input_file):
 
     config["arch_config_list"] = arch_config_list + ['--cpu-type=X86O3CPU', '--caches', '--l2cache'] + ['--options=' + workload_opt] + ['--input=' + workload_input]
 
+    # model identical cores as one McPAT core with their average activity
+    config["homogeneous_cores"] = bool(arch.get("homogeneous_cores", False))
+
     # stacking configuration
     thermal = inputs["thermal"]
     if not thermal.get("hotspot_inputs_dir"):
@@ -112,6 +127,31 @@ def parse_input(input_file):
     else:
         config["microfluidic_cooling"] = False
     
+    if thermal.get("transient"):
+        config["transient"] = bool(thermal["transient"])
+    else:
+        config["transient"] = False
+
+    if thermal.get("thermal_kernel"):
+        config["thermal_kernel"] = bool(thermal["thermal_kernel"])
+    else:
+        config["thermal_kernel"] = False
+
+    # temperature above which a grid cell counts as a hotspot in the thermal metrics, 85C by default
+    config["hotspot_threshold"] = float(thermal.get("hotspot_threshold", 358.15))
+
+    # leakage-temperature feedback between HotSpot and McPAT/CACTI-3DD
+    config["leakage_feedback"] = bool(thermal.get("leakage_feedback", False))
+    if config["leakage_feedback"] and config["transient"]:
+        print("[COOL-3D] Error: Leakage feedback is only supported for steady simulations in ", input_file)
+        exit(1)
+    config["leakage_tolerance"] = float(thermal.get("leakage_tolerance", 0.5))
+    config["leakage_max_iterations"] = int(thermal.get("leakage_max_iterations", 10))
+    config["leakage_temperature"] = thermal.get("leakage_temperature", "mean")
+    if config["leakage_temperature"] not in ["mean", "peak"]:
+        print("[COOL-3D] Error: Leakage temperature must be mean or peak in ", input_file)
+        exit(1)
+
     if not glob.glob(os.path.join(config["hotspot_inputs_dir"], '*.lcf')):
         print("[COOL-3D] Error: Stacking configuration file (.lcf) not found in ", config["hotspot_inputs_dir"])
         exit(1)
@@ -125,6 +165,36 @@ def parse_input(input_file):
 
     print(config["sim_resolution"])
 
+    # coarse-to-fine solve, in its own section since list values under thermal are swept
+    adaptive = inputs.get("adaptive_resolution")
+    if not adaptive:
+        config["adaptive_resolution"] = None
+    else:
+        if not adaptive.get("levels"):
+            print("[COOL-3D] Error: Resolution levels not found in adaptive_resolution of ", input_file)
+            exit(1)
+        if adaptive.get("tolerance") is None and adaptive.get("peak_threshold") is None:
+            print("[COOL-3D] Error: Neither tolerance nor peak_threshold given in adaptive_resolution of ", input_file)
+            exit(1)
+        rows, cols = config["sim_resolution"]
+        levels = []
+        for level in adaptive["levels"]:
+            # a single number is the number of rows, the columns follow the aspect ratio of sim_resolution
+            level = [int(level[0]), int(level[1])] if isinstance(level, list) else [int(level), max(1, round(int(level) * cols / rows))]
+            levels.append(level)
+        # every level refines the previous one in both dimensions, the last one is at most sim_resolution
+        refining = all(fine[0] >= coarse[0] and fine[1] >= coarse[1] and fine != coarse for coarse, fine in zip(levels, levels[1:]))
+        if not refining or levels[-1][0] > rows or levels[-1][1] > cols:
+            print("[COOL-3D] Error: Resolution levels must refine both rows and columns and not be finer than sim_resolution in ", input_file)
+            exit(1)
+        if levels[-1] != config["sim_resolution"]:
+            levels.append(config["sim_resolution"])
+        config["adaptive_resolution"] = {
+            "levels": levels,
+            "tolerance": None if adaptive.get("tolerance") is None else float(adaptive["tolerance"]),
+            "peak_threshold": None if adaptive.get("peak_threshold") is None else float(adaptive["peak_threshold"]),
+        }
+
     # output directory
     if not inputs.get("outdir"):
         outdir = os.path.join(os.environ['COOL3D_ROOT'], 'outputs')
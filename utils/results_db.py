@@ -0,0 +1,296 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+
+import numpy as np
+
+try:
+    from utils.cache import file_digest, make_key
+    from utils.coremem_ptrace_combine import read_core_ptrace
+except ImportError:  # run as a script from the utils directory
+    from cache import file_digest, make_key
+    from coremem_ptrace_combine import read_core_ptrace
+
+# Local database of finished runs. Every run is one row of the runs table holding its results,
+# and its design parameters are rows of the params table, indexed by (name, value), so that a
+# sweep of thousands of design points is ranked or filtered with a query instead of a crawl
+# through the output directories.
+
+# sections of inputs.yaml that describe the design
+DESIGN_SECTIONS = ['arch', 'thermal', 'workload']
+
+# result columns of the runs table that can be ranked on, lower is better
+RESULT_COLUMNS = [
+    'peak', 'mean', 'max_gradient', 'hotspot_area',
+    'total_power', 'core_power', 'mem_power', 'elapsed_s',
+]
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created REAL,
+    status TEXT,
+    outdir TEXT,
+    config_hash TEXT,
+    config TEXT,
+    stage_hashes TEXT,
+    timings TEXT,
+    elapsed_s REAL,
+    core_power REAL,
+    mem_power REAL,
+    total_power REAL,
+    peak REAL,
+    peak_layer INTEGER,
+    mean REAL,
+    max_gradient REAL,
+    hotspot_area REAL
+);
+CREATE TABLE IF NOT EXISTS params (
+    run_id INTEGER REFERENCES runs(id) ON DELETE CASCADE,
+    name TEXT,
+    value TEXT,
+    num REAL,
+    PRIMARY KEY (run_id, name)
+);
+CREATE INDEX IF NOT EXISTS params_num ON params (name, num);
+CREATE INDEX IF NOT EXISTS params_value ON params (name, value);
+CREATE INDEX IF NOT EXISTS runs_config ON runs (config_hash);
+CREATE INDEX IF NOT EXISTS runs_peak ON runs (status, peak);
+CREATE INDEX IF NOT EXISTS runs_power ON runs (status, total_power);
+'''
+
+def default_db_file():
+    return os.environ.get('COOL3D_RESULTS_DB') or os.path.join(os.environ['COOL3D_ROOT'], 'results.db')
+
+def connect(db_file=None):
+    # @db_file: str, path to the database, default to $COOL3D_RESULTS_DB or $COOL3D_ROOT/results.db
+    # return: sqlite3 connection with the schema created
+
+    db_file = db_file or default_db_file()
+    if os.path.dirname(db_file):
+        os.makedirs(os.path.dirname(db_file), exist_ok=True)
+    # sweep workers register concurrently, wait for each other instead of failing
+    conn = sqlite3.connect(db_file, timeout=60)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA foreign_keys=ON')
+    conn.executescript(SCHEMA)
+    return conn
+
+def normalize_inputs(inputs):
+    # @inputs: dict, raw content of a top level yaml input file
+    # return: dict, the design sections with environment variables expanded
+
+    config = {}
+    for section in DESIGN_SECTIONS:
+        values = {}
+        for key, value in (inputs.get(section) or {}).items():
+            values[key] = os.path.expandvars(value) if isinstance(value, str) else value
+        config[section] = values
+    return config
+
+def design_params(config):
+    # @config: dict, normalized inputs as returned by normalize_inputs
+    # return: dict<'section.key', scalar value>
+
+    params = {}
+    for section, values in config.items():
+        if not isinstance(values, dict):
+            continue
+        for key, value in values.items():
+            if value is None or isinstance(value, (bool, int, float, str)):
+                params[section + '.' + key] = value
+    return params
+
+def to_number(value):
+    # return: float value of a parameter, None if it is not numeric
+    if isinstance(value, bool):
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def ptrace_total(ptrace_file):
+    # return: float, total power of a power trace averaged over its rows, None if the trace is missing
+    if not os.path.isfile(ptrace_file):
+        return None
+    # parsed like the pipeline parses it, McPAT may leave Warning lines in its trace
+    _, rows = read_core_ptrace(ptrace_file)
+    if not rows:
+        return None
+    power = np.array(rows, dtype=float)
+    return round(float(power.sum(axis=1).mean()), 6)
+
+def register_run(outdir, config, stages=None, status='done', elapsed=None, db_file=None):
+    # Register a run of the pipeline in the results database
+    # @outdir: str, output directory of the run
+    # @config: dict, normalized inputs of the run, see normalize_inputs
+    # @stages: list<utils.scheduler.Stage> of the run, for the stage output hashes and timings
+    # @status: str, 'done' or 'failed'
+    # @elapsed: float, wall time of the whole run in seconds
+    # @db_file: str, path to the database
+    # return: int, id of the run
+
+    stage_hashes = {}
+    timings = {}
+    for stage in stages or []:
+        outputs = [path for path in stage.outputs if os.path.isfile(path)]
+        if outputs:
+            stage_hashes[stage.name] = make_key(*[file_digest(path) for path in outputs])
+        if stage.elapsed is not None:
+            timings[stage.name] = round(stage.elapsed, 3)
+
+    core_power = ptrace_total(os.path.join(outdir, 'power', 'mcpat_out.ptrace'))
+    mem_power = ptrace_total(os.path.join(outdir, 'power', 'mem.ptrace'))
+    total_power = None
+    if core_power is not None and mem_power is not None:
+        total_power = round(core_power + mem_power, 6)
+
+    summary = {}
+    metrics_file = os.path.join(outdir, 'thermal', 'metrics.json')
+    if os.path.isfile(metrics_file):
+        with open(metrics_file) as f:
+            summary = json.load(f)['summary']
+
+    row = {
+        'created': time.time(),
+        'status': status,
+        'outdir': os.path.abspath(outdir),
+        'config_hash': make_key(config),
+        'config': json.dumps(config, sort_keys=True, default=str),
+        'stage_hashes': json.dumps(stage_hashes, sort_keys=True),
+        'timings': json.dumps(timings, sort_keys=True),
+        'elapsed_s': None if elapsed is None else round(elapsed, 3),
+        'core_power': core_power,
+        'mem_power': mem_power,
+        'total_power': total_power,
+        'peak': summary.get('peak'),
+        'peak_layer': summary.get('peak_layer'),
+        'mean': summary.get('mean'),
+        'max_gradient': summary.get('max_gradient_K_per_mm'),
+        'hotspot_area': summary.get('hotspot_area_mm2'),
+    }
+    conn = connect(db_file)
+    try:
+        with conn:
+            cursor = conn.execute('INSERT INTO runs (%s) VALUES (%s)' % (', '.join(row), ', '.join('?' * len(row))), list(row.values()))
+            run_id = cursor.lastrowid
+            conn.executemany('INSERT INTO params (run_id, name, value, num) VALUES (?, ?, ?, ?)',
+                [(run_id, name, None if value is None else str(value), to_number(value)) for name, value in design_params(config).items()])
+    finally:
+        conn.close()
+    print("[COOL-3D] Run registered as", run_id, "in", db_file or default_db_file())
+    return run_id
+
+def parse_filters(filters):
+    # @filters: list of 'section.key=value' strings
+    # return: list of (name, value) pairs
+
+    pairs = []
+    for item in filters or []:
+        if '=' not in item:
+            raise ValueError("Filter " + item + " is not of the form section.key=value")
+        name, value = item.split('=', 1)
+        pairs.append((name.strip(), value.strip()))
+    return pairs
+
+def filter_clause(filters):
+    # return: sql condition on runs.id and its arguments selecting the runs matching every filter
+    clauses = []
+    args = []
+    for name, value in filters:
+        number = to_number(value)
+        if number is not None:
+            clauses.append('runs.id IN (SELECT run_id FROM params WHERE name = ? AND num = ?)')
+            args += [name, number]
+        else:
+            clauses.append('runs.id IN (SELECT run_id FROM params WHERE name = ? AND value = ?)')
+            args += [name, value]
+    return ' AND '.join(["runs.status = 'done'"] + clauses), args
+
+def check_columns(columns):
+    for column in columns:
+        if column not in RESULT_COLUMNS:
+            raise ValueError("Unknown result column " + column + ", expected one of " + ', '.join(RESULT_COLUMNS))
+
+def query_top(conn, by, k=10, filters=None, descending=False):
+    # @by: str, result column to rank on
+    # @k: int, number of runs returned
+    # @filters: list of (name, value) design parameter filters
+    # @descending: bool, rank the highest values first
+    # return: list of sqlite3.Row
+
+    check_columns([by])
+    where, args = filter_clause(filters or [])
+    sql = 'SELECT * FROM runs WHERE %s AND %s IS NOT NULL ORDER BY %s %s LIMIT ?' % (where, by, by, 'DESC' if descending else 'ASC')
+    return conn.execute(sql, args + [k]).fetchall()
+
+def query_pareto(conn, objectives, filters=None):
+    # @objectives: list of result columns, all minimized
+    # @filters: list of (name, value) design parameter filters
+    # return: list of sqlite3.Row, the runs no other run is at least as good as on every objective and better on one
+
+    check_columns(objectives)
+    where, args = filter_clause(filters or [])
+    sql = 'SELECT * FROM runs WHERE %s AND %s ORDER BY %s' % (
+        where, ' AND '.join(o + ' IS NOT NULL' for o in objectives), ', '.join(objectives))
+    front = []
+    # in lexicographic order a run can only be dominated by runs before it
+    for row in conn.execute(sql, args):
+        point = [row[o] for o in objectives]
+        dominated = False
+        for other in front:
+            values = [other[o] for o in objectives]
+            if all(v <= p for v, p in zip(values, point)) and values != point:
+                dominated = True
+                break
+        if not dominated:
+            front.append(row)
+    return front
+
+def run_params(conn, run_id):
+    # return: dict<'section.key', str value> of a run
+    return {row['name']: row['value'] for row in conn.execute('SELECT name, value FROM params WHERE run_id = ? ORDER BY name', (run_id,))}
+
+def print_runs(conn, rows, columns, params=None):
+    # @columns: list of result columns to show
+    # @params: list of design parameters to show, default to the ones that differ between the rows
+
+    details = [run_params(conn, row['id']) for row in rows]
+    if params is None:
+        names = sorted(set(name for detail in details for name in detail))
+        params = [name for name in names if len(set(detail.get(name) for detail in details)) > 1]
+    header = ['id'] + columns + params + ['outdir']
+    table = [header]
+    for row, detail in zip(rows, details):
+        table.append([str(row['id'])] + [str(row[c]) for c in columns] + [str(detail.get(p)) for p in params] + [row['outdir']])
+    widths = [max(len(line[i]) for line in table) for i in range(len(header))]
+    for line in table:
+        print('  '.join(value.ljust(width) for value, width in zip(line, widths)).rstrip())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query the Cool-3D results database')
+    parser.add_argument('--db', type=str, help='results database, default to $COOL3D_RESULTS_DB or $COOL3D_ROOT/results.db')
+    parser.add_argument('--where', type=str, action='append', help='design parameter filter, e.g. arch.num_cores=4, can be repeated')
+    parser.add_argument('--params', type=str, help='comma separated design parameters to show, default to the ones that differ')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    top_parser = subparsers.add_parser('top', help='k best runs on one result')
+    top_parser.add_argument('--by', type=str, default='peak', help='result to rank on: ' + ', '.join(RESULT_COLUMNS))
+    top_parser.add_argument('-k', type=int, default=10, help='number of runs')
+    top_parser.add_argument('--desc', action='store_true', help='rank the highest values first')
+    pareto_parser = subparsers.add_parser('pareto', help='Pareto front of the runs over several results, all minimized')
+    pareto_parser.add_argument('--objectives', type=str, default='peak,total_power', help='comma separated results')
+
+    args = parser.parse_args()
+    conn = connect(args.db)
+    filters = parse_filters(args.where)
+    params = args.params.split(',') if args.params else None
+    if args.command == 'top':
+        print_runs(conn, query_top(conn, args.by, args.k, filters, args.desc), [args.by], params)
+    else:
+        objectives = args.objectives.split(',')
+        print_runs(conn, query_pareto(conn, objectives, filters), objectives, params)
+    conn.close()
@@ -1,55 +1,165 @@
 import os
+import time
 
 from utils.run_helper import *
+from utils.scheduler import Stage, run_stages
+from utils.cache import ResultCache
+from utils.results_db import register_run, normalize_inputs
+from utils.timing import Trace, trace_events, write_trace_events
 
-def run(configs, workload, outdir):
+def run(configs, workload, outdir, max_workers=None, use_cache=True, inputs=None, results_db=True, resume=False, trace=False):
     # @configs: {
-    #   'arch_config_file': str<gem5_config_file>, 
-    #   'arch_config_list': list<gem5_config_list>, 
+    #   'arch_config_file': str<gem5_config_file>,
+    #   'arch_config_list': list<gem5_config_list>,
     #   '3Dmem_config_file': str<3dmem_config_file>,
     #   'hotspot_inputs_dir': str<hotspot_inputs_dir>,
     #   'is_core_list': str<is_core_list>,
     #   'banks_per_layer': str<banks_per_layer>
     #   'microfluidic_cooling': bool<microfluidic_cooling>
+    #   'transient': bool<one power trace row per gem5 stats dump>
+    #   'thermal_kernel': bool<steady temperatures from the thermal response matrix of the stack>
+    #   'leakage_feedback': bool<iterate HotSpot with leakage at the temperatures it finds>
+    #   'adaptive_resolution': dict<coarse-to-fine grid levels and stopping criteria> or None
+    #   'hotspot_threshold': float<temperature in K above which a grid cell counts as a hotspot>
     #   ...}
     # @workload: str, path to workload executable
     # @outdir: str, path to output directory
+    # @max_workers: int, maximum number of stages running concurrently, default to no limit
+    # @use_cache: bool, reuse stage results of previous runs with identical inputs
+    # @inputs: dict, raw content of the yaml input file, its design sections are registered as the run parameters
+    # @results_db: bool or str, register the run in the default results database or the one at this path
+    # @resume: skip the stages completed by a previous run in outdir and restart at the first incomplete one
+    # @trace: also write the stage timings of outdir/timings.json as a Chrome trace_event file outdir/trace.json
 
-    gem5_outdir = os.path.join(outdir, 'perf')
-    gen_performance_trace(
-        configs['arch_config_file'], 
-        configs['arch_config_list'], 
-        workload, 
-        gem5_outdir
-    )
+    cache = ResultCache() if use_cache else None
 
+    gem5_outdir = os.path.join(outdir, 'perf')
     mcpat_outdir = os.path.join(outdir, 'power')
-    gen_core_power_trace(
-        gem5_outdir, 
-        mcpat_outdir
-    )
-
     cacti_outdir = os.path.join(outdir, 'power')
-    gen_mem_power_trace(
-        configs['3dmem_config_file'], 
-        gem5_outdir, 
-        cacti_outdir
-    )
-
     hotspot_outdir = os.path.join(outdir, 'thermal')
-    gen_temperature_trace(
-        mcpat_outdir=mcpat_outdir, 
-        cacti_outdir=cacti_outdir,
-        inputs_dir=configs['hotspot_inputs_dir'],
-        is_core_list=configs['is_core_list'],
-        banks_per_layer=configs['banks_per_layer'],
-        hotspot_outdir=hotspot_outdir, 
-        microfluidic_cooling=configs['microfluidic_cooling'] 
-    )
 
-    visualize(
-        hotspot_outdir=hotspot_outdir,
-        hotspot_inputs_dir=configs['hotspot_inputs_dir'],
-        num_layers=configs['num_layers_total'],
-        resolution=configs['sim_resolution']
-    )
\ No newline at end of file
+    gem5_stats = os.path.join(gem5_outdir, 'stats.txt')
+    gem5_config = os.path.join(gem5_outdir, 'config.json')
+    cacti_out = os.path.join(cacti_outdir, os.path.basename(configs['3dmem_config_file']) + '.out')
+    core_ptrace = os.path.join(mcpat_outdir, 'mcpat_out.ptrace')
+    mem_ptrace = os.path.join(cacti_outdir, 'mem.ptrace')
+    grid_steady = os.path.join(hotspot_outdir, 'coremem.grid.steady')
+    leakage_log = os.path.join(hotspot_outdir, 'leakage.json')
+    grid_npy = os.path.join(hotspot_outdir, 'coremem.grid.npy')
+    metrics_json = os.path.join(hotspot_outdir, 'metrics.json')
+
+    # each stage declares the files it reads and writes, stages without
+    # a path between them in the dependency graph run concurrently
+    stages = [
+        Stage('gem5', gen_performance_trace,
+            inputs=[configs['arch_config_file'], workload],
+            outputs=[gem5_stats, gem5_config],
+            config_file=configs['arch_config_file'],
+            config_list=configs['arch_config_list'],
+            workload=workload,
+            outdir=gem5_outdir,
+            cache=cache
+        ),
+        Stage('cacti', run_cacti,
+            inputs=[configs['3dmem_config_file']],
+            outputs=[cacti_out],
+            cacti_in=configs['3dmem_config_file'],
+            cacti_outdir=cacti_outdir,
+            cache=cache
+        ),
+        Stage('mcpat', gen_core_power_trace,
+            inputs=[gem5_stats, gem5_config],
+            outputs=[core_ptrace],
+            gem5_outdir=gem5_outdir,
+            outdir=mcpat_outdir,
+            cache=cache,
+            epochs=configs['transient'],
+            homogeneous=configs['homogeneous_cores']
+        ),
+        Stage('mem_power', gen_mem_power_trace,
+            inputs=[gem5_stats, gem5_config, cacti_out],
+            outputs=[mem_ptrace],
+            cacti_in=configs['3dmem_config_file'],
+            gem5_output=gem5_outdir,
+            cacti_outdir=cacti_outdir,
+            epochs=configs['transient']
+        ),
+        Stage('hotspot', gen_temperature_trace,
+            inputs=[core_ptrace, mem_ptrace],
+            outputs=[grid_steady],
+            mcpat_outdir=mcpat_outdir,
+            cacti_outdir=cacti_outdir,
+            inputs_dir=configs['hotspot_inputs_dir'],
+            is_core_list=configs['is_core_list'],
+            banks_per_layer=configs['banks_per_layer'],
+            hotspot_outdir=hotspot_outdir,
+            microfluidic_cooling=configs['microfluidic_cooling'],
+            cache=cache,
+            gem5_outdir=gem5_outdir if configs['transient'] else None,
+            use_kernel=configs['thermal_kernel'],
+            adaptive=configs['adaptive_resolution']
+        ),
+    ]
+    if configs['leakage_feedback']:
+        # re-solve the temperatures with the leakage evaluated at the temperatures of the previous solve
+        stages.append(Stage('leakage', leakage_feedback,
+            inputs=[grid_steady, cacti_out],
+            outputs=[leakage_log],
+            gem5_outdir=gem5_outdir,
+            mcpat_outdir=mcpat_outdir,
+            cacti_in=configs['3dmem_config_file'],
+            cacti_outdir=cacti_outdir,
+            inputs_dir=configs['hotspot_inputs_dir'],
+            is_core_list=configs['is_core_list'],
+            banks_per_layer=configs['banks_per_layer'],
+            hotspot_outdir=hotspot_outdir,
+            microfluidic_cooling=configs['microfluidic_cooling'],
+            cache=cache,
+            use_kernel=configs['thermal_kernel'],
+            layer_temperature=configs['leakage_temperature'],
+            tolerance=configs['leakage_tolerance'],
+            max_iterations=configs['leakage_max_iterations'],
+            adaptive=configs['adaptive_resolution']
+        ))
+    stages += [
+        Stage('grid', convert_grid,
+            inputs=[leakage_log if configs['leakage_feedback'] else grid_steady],
+            outputs=[grid_npy],
+            hotspot_outdir=hotspot_outdir,
+            hotspot_inputs_dir=configs['hotspot_inputs_dir'],
+            resolution=configs['sim_resolution']
+        ),
+        Stage('metrics', gen_thermal_metrics,
+            inputs=[grid_npy],
+            outputs=[metrics_json],
+            hotspot_outdir=hotspot_outdir,
+            hotspot_inputs_dir=configs['hotspot_inputs_dir'],
+            threshold=configs['hotspot_threshold']
+        ),
+        Stage('visualize', visualize,
+            inputs=[grid_npy],
+            hotspot_outdir=hotspot_outdir,
+            hotspot_inputs_dir=configs['hotspot_inputs_dir'],
+            num_layers=configs['num_layers_total'],
+            cache=cache
+        ),
+    ]
+
+    start = time.time()
+    status = 'failed'
+    timing = Trace()
+    try:
+        run_stages(stages, max_workers=max_workers, state_dir=os.path.join(outdir, 'stages'), resume=resume, trace=timing)
+        status = 'done'
+    finally:
+        timings = timing.write_timings(os.path.join(outdir, 'timings.json'))
+        if trace:
+            write_trace_events(trace_events(timings, label=outdir), os.path.join(outdir, 'trace.json'))
+        if results_db:
+            # a failed registration must neither fail a finished run nor hide the error of a failed one
+            try:
+                config = normalize_inputs(inputs) if inputs is not None else {'configs': configs, 'workload': workload}
+                register_run(outdir, config, stages, status=status, elapsed=time.time() - start,
+                    db_file=results_db if isinstance(results_db, str) else None)
+            except Exception as e:
+                print("[COOL-3D] Warning: Run not registered in the results database:", e)
@@ -1,13 +1,58 @@
-import subprocess
 import os
 import glob
+import shutil
+import tempfile
+import re
+import json
+import threading
+import itertools
+import concurrent.futures
 
-def gen_performance_trace(config_file, config_list, workload, outdir):
+import numpy as np
+
+from utils.cache import ResultCache, file_digest, dir_digest, xml_digest, make_key, exec_stamp
+from utils import gem52mcpat_parser
+from utils.generate_template import generate_template
+from utils.mem_power import gen_mem_ptrace, read_cacti_leakage, dram_bank_count
+from utils.cacti_config import normalize_cacti_cfg, write_cacti_cfg
+from utils.coremem_ptrace_combine import combine_ptrace, read_core_ptrace
+from utils.stats import load_stats, iter_timed_epochs
+from utils.gem5_config import load_config
+from utils.thermal_grid import read_grid_steady, read_block_steady, rasterize_microchannels, convert_grid_steady, load_grid
+from utils.thermal_kernel import read_ptrace
+from utils import thermal_kernel
+from utils.thermal_map import render_thermal_maps
+from utils.thermal_metrics import write_metrics, HOTSPOT_THRESHOLD
+from utils.timing import run_command, in_context
+
+# parsed gem5 outputs shared between the stages of a run, keyed on the gem5 output directory
+gem5_outputs = {}
+gem5_outputs_lock = threading.Lock()
+
+def read_gem5_outputs(gem5_outdir):
+    # Parse config.json and stats.txt of a gem5 run once for all the stages consuming them
+    # @gem5_outdir: path to the gem5 output directory
+    # return: (utils.gem5_config.Gem5Config, dict<stat name, int or float>)
+
+    config_file = os.path.join(gem5_outdir, 'config.json')
+    stats_file = os.path.join(gem5_outdir, 'stats.txt')
+    stamp = [(os.path.getmtime(path), os.path.getsize(path)) for path in [config_file, stats_file]]
+    with gem5_outputs_lock:
+        cached = gem5_outputs.get(os.path.abspath(gem5_outdir))
+        if cached is None or cached[0] != stamp:
+            config = load_config(config_file)
+            stats = load_stats(stats_file)
+            cached = (stamp, config, stats)
+            gem5_outputs[os.path.abspath(gem5_outdir)] = cached
+    return cached[1], cached[2]
+
+def gen_performance_trace(config_file, config_list, workload, outdir, cache=None):
     # Run gem5 simulation and generate performance trace
     # @config_file: path to .py file for gem5 configuration
     # @config_list: list of configuration options based on the config file
     # @workload: path to the workload executable
     # @outdir: output directory for gem5 simulation
+    # @cache: utils.cache.ResultCache to reuse results of identical runs, None to disable
 
     gem5_root = os.environ['GEM5_ROOT']
     gem5_build = os.path.join(gem5_root, 'build')
@@ -16,68 +61,191 @@ def gen_performance_trace(config_file, config_list, workload, outdir):
     if type(config_list) is str:
         configs = config_list.split()
         config_list = [config for config in configs]
+    if cache is not None:
+        key = make_key('gem5', exec_stamp(sim_exec), file_digest(gem5_config), file_digest(workload), config_list)
+        if cache.restore('gem5', key, outdir):
+            print("[COOL-3D] Performance trace restored at ", outdir)
+            return
     cmd = [sim_exec, "--outdir", outdir, gem5_config, "--cmd", workload] + config_list
-    subprocess.run(cmd)
+    run_command(cmd)
+    if cache is not None:
+        cache.store('gem5', key, [os.path.join(outdir, name) for name in os.listdir(outdir)])
     print("[COOL-3D] Performance trace generated at ", outdir)
 
-def gen_core_power_trace(gem5_outdir, outdir):
+def run_mcpat(mcpat_in, outdir, cache=None):
+    # Run McPAT on one input xml
+    # @mcpat_in: path to the McPAT input xml
+    # @outdir: directory receiving mcpat_out.ptrace, mcpat_out.area and mcpat_out.area_hierarchy
+    # @cache: utils.cache.ResultCache to reuse results of identical runs, None to disable
+    # return: bool, whether the result was restored from the cache
+
+    mcpat_exec = os.path.join(os.environ['MCPAT_ROOT'], 'mcpat')
+    mcpat_flags = ['-print_level', '5', '-opt_for_clk', '1']
+    mcpat_outputs = [os.path.join(outdir, 'mcpat_out.' + ext) for ext in ['ptrace', 'area', 'area_hierarchy']]
+    if cache is not None:
+        # sweep points differing only outside the core model produce the same xml up to formatting
+        key = make_key('mcpat', exec_stamp(mcpat_exec), xml_digest(mcpat_in), mcpat_flags)
+        if cache.restore('mcpat', key, outdir):
+            return True
+    # McPAT writes out.* to its working directory, give every run a private one
+    tmp_dir = tempfile.mkdtemp(prefix='cool_3d_mcpat_', dir=outdir)
+    try:
+        cmd = [mcpat_exec, '-infile', os.path.abspath(mcpat_in)] + mcpat_flags
+        run_command(cmd, cwd=tmp_dir)
+        # McPAT spells the hierarchy file out.area_hierachy
+        for src, ext in [('out.ptrace', 'ptrace'), ('out.area', 'area'), ('out.area_hierachy', 'area_hierarchy')]:
+            shutil.move(os.path.join(tmp_dir, src), os.path.join(outdir, 'mcpat_out.' + ext))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if cache is not None:
+        cache.store('mcpat', key, mcpat_outputs, meta={'flags': mcpat_flags})
+    return False
+
+def gen_core_power_trace(gem5_outdir, outdir, cache=None, epochs=False, jobs=None, homogeneous=False):
     # Run McPAT and generate core power trace
     # @gem5_outdir: path to the gem5 output directory
     # @outdir: output directory for McPAT simulation
+    # @cache: utils.cache.ResultCache to reuse results of identical runs, None to disable
+    # @epochs: output one power trace row per gem5 stats dump instead of a single row
+    # @jobs: int, maximum number of McPAT runs in flight in epoch mode, default to the cpu count
+    # @homogeneous: model identical cores as one McPAT core with their average stats
 
-    mcpat_root = os.environ['MCPAT_ROOT']
-    utils_root = os.path.join(os.environ['COOL3D_ROOT'], 'utils')
-    # parse gem5 output to generate McPAT input
-    stats = os.path.join(gem5_outdir, 'stats.txt')
-    config = os.path.join(gem5_outdir, 'config.json')
-    template = os.path.join(utils_root, 'template_parser.xml')
-    cmd = ['python3', os.path.join(utils_root, 'generate_template.py')]
-    subprocess.run(cmd)
-    cmd = ['python3', os.path.join(utils_root, 'gem52mcpat_parser.py'), '-c', config, '-s', stats, '-t', template]
-    subprocess.run(cmd)
+    # every intermediate file stays in outdir so that concurrent runs do not collide
     cmd = ['mkdir', '-p', outdir]
-    subprocess.run(cmd)
-    cmd = ['mv', 'mcpat_in.xml', outdir]
-    subprocess.run(cmd)
+    run_command(cmd)
+    template = os.path.join(outdir, 'template_parser.xml')
+    generate_template(template)
+    if epochs:
+        gen_epoch_core_power_trace(gem5_outdir, outdir, template, cache, jobs, homogeneous)
+        return
+
+    # parse gem5 output to generate McPAT input
+    config, stats = read_gem5_outputs(gem5_outdir)
+    gem52mcpat_parser.genMcpatXml(config, stats, template, os.path.join(outdir, 'mcpat_in.xml'), homogeneous)
     print("[COOL-3D] McPAT input prepared at ", outdir)
 
-    # run mcpat
-    mcpat_exec = os.path.join(mcpat_root, 'mcpat')
-    cmd = [mcpat_exec, '-infile', os.path.join(outdir, 'mcpat_in.xml'), '-print_level', '5', '-opt_for_clk', '1']
-    subprocess.run(cmd)
-    cmd = ['mv', 'out.ptrace', os.path.join(outdir, 'mcpat_out.ptrace')]
-    subprocess.run(cmd)
-    cmd = ['mv', 'out.area', os.path.join(outdir, 'mcpat_out.area')]
-    subprocess.run(cmd)
-    cmd = ['mv', 'out.area_hierarchy', os.path.join(outdir, 'mcpat_out.area_hierarchy')]
-    subprocess.run(cmd)
+    if run_mcpat(os.path.join(outdir, 'mcpat_in.xml'), outdir, cache):
+        print("[COOL-3D] Core power trace restored at ", outdir)
+    else:
+        print("[COOL-3D] Core power trace generated at ", outdir)
+
+def gen_epoch_core_power_trace(gem5_outdir, outdir, template, cache=None, jobs=None, homogeneous=False):
+    # Run McPAT once per gem5 stats dump and stitch the results into one power trace
+    # @gem5_outdir: path to the gem5 output directory
+    # @outdir: output directory for McPAT simulation, per epoch runs go to outdir/epochs
+    # @template: path to the McPAT template xml
+    # @cache: utils.cache.ResultCache to reuse results of identical runs, None to disable
+    # @jobs: int, maximum number of McPAT runs in flight, default to the cpu count
+    # @homogeneous: model identical cores as one McPAT core with their average stats
+
+    config, _ = read_gem5_outputs(gem5_outdir)
+    epochs_dir = os.path.join(outdir, 'epochs')
+    shutil.rmtree(epochs_dir, ignore_errors=True)
+    os.makedirs(epochs_dir)
+
+    def epoch_inputs():
+        # the directory of an epoch is created when the parser reaches it
+        for epoch in itertools.count():
+            epoch_dir = os.path.join(epochs_dir, '%06d' % epoch)
+            os.makedirs(epoch_dir)
+            yield os.path.join(epoch_dir, 'mcpat_in.xml')
+
+    # the xml generation is serial since gem52mcpat_parser keeps its state in module globals,
+    # the template is expanded once for all the epochs and McPAT runs of already generated
+    # epochs proceed in the pool meanwhile
+    epoch_dirs = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        futures = []
+        snapshots = iter_timed_epochs(os.path.join(gem5_outdir, 'stats.txt'))
+        for mcpat_in in gem52mcpat_parser.genMcpatXmls(config, snapshots, template, epoch_inputs(), homogeneous):
+            epoch_dir = os.path.dirname(mcpat_in)
+            futures.append(executor.submit(in_context(run_mcpat), mcpat_in, epoch_dir, cache))
+            epoch_dirs.append(epoch_dir)
+        for future in futures:
+            future.result()
+    if not epoch_dirs:
+        raise ValueError("No stats dump with a simulated interval found in " + os.path.join(gem5_outdir, 'stats.txt'))
+    print("[COOL-3D] McPAT ran on", len(epoch_dirs), "epochs at ", epochs_dir)
+
+    # stitch the rows in time order, the area does not change between epochs
+    with open(os.path.join(outdir, 'mcpat_out.ptrace'), 'w') as f:
+        for epoch, epoch_dir in enumerate(epoch_dirs):
+            header, rows = read_core_ptrace(os.path.join(epoch_dir, 'mcpat_out.ptrace'))
+            if epoch == 0:
+                f.write('\t'.join(header) + '\n')
+            for row in rows:
+                f.write('\t'.join(row) + '\n')
+    for ext in ['area', 'area_hierarchy']:
+        shutil.copy(os.path.join(epoch_dirs[0], 'mcpat_out.' + ext), os.path.join(outdir, 'mcpat_out.' + ext))
     print("[COOL-3D] Core power trace generated at ", outdir)
 
-def gen_mem_power_trace(cacti_in, gem5_output, cacti_outdir):
-    # Run CACTI-3DD and generate memory power trace
+def run_cacti(cacti_in, cacti_outdir, cache=None):
+    # Run CACTI-3DD to characterize the 3D memory
+    # @cacti_in: path to the CACTI-3DD input file
+    # @cacti_outdir: output directory for CACTI-3DD simulation
+    # @cache: utils.cache.ResultCache to reuse results of identical runs, None to disable
+    # return: path to the CACTI-3DD output file
+    if cache is None:
+        return run_cacti_once(cacti_in, cacti_outdir)
+
+    cacti_out = os.path.join(cacti_outdir, os.path.basename(cacti_in) + ".out")
+    # keyed on the active parameters, so comments, formatting and the file name do not matter
+    key = make_key('cacti', exec_stamp(os.path.join(os.environ['CACTI_ROOT'], 'cacti')), normalize_cacti_cfg(cacti_in))
+    # parallel sweep points sharing a memory configuration run CACTI only once
+    with cache.lock('cacti', key):
+        entry = cache.lookup('cacti', key)
+        if entry is not None:
+            try:
+                os.makedirs(cacti_outdir, exist_ok=True)
+                shutil.copy(os.path.join(entry, 'cacti.out'), cacti_out)
+                print("[COOL-3D] CACTI-3DD output restored at ", cacti_outdir)
+                return cacti_out
+            except OSError:
+                pass  # evicted meanwhile
+        run_cacti_once(cacti_in, cacti_outdir)
+        entry_tmp = tempfile.mkdtemp(prefix='cool_3d_cacti_', dir=cacti_outdir)
+        try:
+            shutil.copy(cacti_out, os.path.join(entry_tmp, 'cacti.out'))
+            cache.store('cacti', key, [os.path.join(entry_tmp, 'cacti.out')], meta={'cfg': os.path.abspath(cacti_in)})
+        finally:
+            shutil.rmtree(entry_tmp, ignore_errors=True)
+    return cacti_out
+
+def run_cacti_once(cacti_in, cacti_outdir):
     # @cacti_in: path to the CACTI-3DD input file
-    # @gem5_output: path to the gem5 output directory
     # @cacti_outdir: output directory for CACTI-3DD simulation
+    # return: path to the CACTI-3DD output file
     cacti_root = os.environ['CACTI_ROOT']
-    utils_root = os.path.join(os.environ['COOL3D_ROOT'], 'utils')
-    cmd = ['./cacti', '-infile', cacti_in]
-    subprocess.run(cmd, cwd=cacti_root)
-    cacti_out = cacti_in + ".out"
-    cacti_out_temp_dir = os.path.join(os.path.dirname(cacti_in), cacti_out)
-    cmd = ['mv', cacti_out_temp_dir, cacti_outdir]
-    subprocess.run(cmd)
-    cacti_out = os.path.join(cacti_outdir, os.path.basename(cacti_out))
+    # CACTI writes <infile>.out next to its input, so run it on a private copy of the cfg
+    os.makedirs(cacti_outdir, exist_ok=True)
+    cacti_cfg = os.path.join(os.path.abspath(cacti_outdir), os.path.basename(cacti_in))
+    cmd = ['cp', cacti_in, cacti_cfg]
+    run_command(cmd)
+    cmd = ['./cacti', '-infile', cacti_cfg]
+    run_command(cmd, cwd=cacti_root)
+    cacti_out = cacti_cfg + ".out"
     print("[COOL-3D] CACTI-3DD output generated at ", cacti_outdir)
+    return cacti_out
+
+def gen_mem_power_trace(cacti_in, gem5_output, cacti_outdir, epochs=False):
+    # Generate memory power trace from the CACTI-3DD output of run_cacti
+    # @cacti_in: path to the CACTI-3DD input file
+    # @gem5_output: path to the gem5 output directory
+    # @cacti_outdir: output directory for CACTI-3DD simulation
+    # @epochs: output one power trace row per gem5 stats dump instead of a single steady row
+    cacti_out = os.path.join(cacti_outdir, os.path.basename(cacti_in) + ".out")
 
     stats = os.path.join(gem5_output, 'stats.txt')
     config = os.path.join(gem5_output, 'config.json')
     output = os.path.join(cacti_outdir, 'mem.ptrace')
-    mem_power_calc = os.path.join(utils_root, 'mem_power.py')
-    cmd = ['python3', mem_power_calc, '--gem5-config', config, '--gem5-stats', stats, '--cacti-out', cacti_out, '--output-file', output]
-    subprocess.run(cmd)
+    if epochs:
+        gen_mem_ptrace(config, stats, cacti_out, output, epochs=True)
+    else:
+        gem5_config, gem5_stats = read_gem5_outputs(gem5_output)
+        gen_mem_ptrace(config, stats, cacti_out, output, gem5_config=gem5_config, gem5_stats=gem5_stats)
     print("[COOL-3D] Memory power trace generated at ", cacti_outdir)
 
-def gen_temperature_trace(mcpat_outdir, cacti_outdir, inputs_dir,is_core_list, banks_per_layer, hotspot_outdir, microfluidic_cooling=False):
+def gen_temperature_trace(mcpat_outdir, cacti_outdir, inputs_dir,is_core_list, banks_per_layer, hotspot_outdir, microfluidic_cooling=False, cache=None, gem5_outdir=None, use_kernel=False, adaptive=None):
     # Run HotSpot and generate temperature trace
     # @mcpat_outdir: path to the McPAT output directory
     # @cacti_outdir: path to the CACTI-3DD output directory
@@ -86,88 +254,412 @@ def gen_temperature_trace(mcpat_outdir, cacti_outdir, inputs_dir,is_core_list, b
     # @banks_per_layer: number of memory banks per memory bank layer
     # @hotspot_outdir: output directory for HotSpot simulation
     # @microfluidic_cooling: whether to enable microfluidic cooling
+    # @cache: utils.cache.ResultCache to reuse results of identical runs, None to disable
+    # @gem5_outdir: path to the gem5 output directory, given to run a transient simulation over the stats dumps
+    # @use_kernel: compute the steady temperatures from the thermal response matrix of the stack instead of a HotSpot solve
+    # @adaptive: dict, coarse-to-fine resolution settings, see solve_adaptive_resolution, None to solve once at the config resolution
     hotspot_root = os.environ['HOTSPOT_ROOT']
-    utils_root = os.path.join(os.environ['COOL3D_ROOT'], 'utils')
     # combine the ptraces for core and mem
     core_ptrace = os.path.join(mcpat_outdir, 'mcpat_out.ptrace')
     mem_ptrace = os.path.join(cacti_outdir, 'mem.ptrace')
-    cmd = ['python3', os.path.join(utils_root, 'coremem_ptrace_combine.py'), '--core-ptrace', core_ptrace, '--mem-ptrace', mem_ptrace, '--coremem-ptrace', os.path.join(mcpat_outdir, 'coremem.ptrace'), '--is-core', is_core_list, '--banks-per-layer', banks_per_layer]
-    subprocess.run(cmd)
+    combine_ptrace(core_ptrace, mem_ptrace, is_core_list, int(banks_per_layer), os.path.join(mcpat_outdir, 'coremem.ptrace'))
     print("[COOL-3D] Core and memory ptraces combined at ", mcpat_outdir)
 
-    # prepare hotspot inputs
-    hotspot_running_dir = os.path.join(hotspot_root, 'cool_3d_thermal')
-    cmd = ['rm', '-rf', hotspot_running_dir]
-    subprocess.run(cmd)
-    cmd = ['cp', inputs_dir, '-r', hotspot_running_dir]
-    subprocess.run(cmd)
-    # hotspot_running_dir = os.path.join(hotspot_root, os.path.basename(inputs_dir))
-    config = glob.glob(os.path.join(hotspot_running_dir, '*.config'))[0]
-    materials = glob.glob(os.path.join(hotspot_running_dir, '*.materials'))[0]
-    stack = glob.glob(os.path.join(hotspot_running_dir, '*.lcf'))[0]
-    ptrace = os.path.join(mcpat_outdir, 'coremem.ptrace')
-    cmd = ['cp', ptrace, hotspot_running_dir]
-    subprocess.run(cmd)
-    print("[COOL-3D] Hotspot inputs copied to ", hotspot_root)
-    
-    # run hotspot
-    cmd = ['rm', '-rf', 'outputs']
-    subprocess.run(cmd, cwd=hotspot_running_dir)
-    cmd = ['mkdir', '-p', 'outputs']
-    subprocess.run(cmd, cwd=hotspot_running_dir)
-    cmd = ['../hotspot', 
-           '-p', 'coremem.ptrace', # need absolute path
-           '-c', config, 
-           '-materials_file', materials, 
-           '-grid_layer_file', stack, 
-           '-model_type', 'grid', 
-           '-detailed_3D', 'on', 
-           '-steady_file', 'outputs/coremem.steady',
-           '-grid_steady_file', 'outputs/coremem.grid.steady']
-    if microfluidic_cooling:
-        cmd += ['-use_microchannels', '1']
-    subprocess.run(cmd, cwd=hotspot_running_dir)
-    print("[COOL-3D] Hotspot simulation done at ", hotspot_running_dir)
-
-    # move the outputs to main output directory
+    # transient simulation steps through the ptrace rows at the average stats dump interval
+    extra_args = []
+    if gem5_outdir is not None:
+        intervals = [epoch['simSeconds'] for epoch in iter_timed_epochs(os.path.join(gem5_outdir, 'stats.txt'))]
+        if intervals:
+            sampling_intvl = sum(intervals) / len(intervals)
+            extra_args = ['-o', os.path.join(os.path.abspath(hotspot_outdir), 'coremem.ttrace'), '-sampling_intvl', str(sampling_intvl)]
+
     cmd = ['rm', '-rf', hotspot_outdir]
-    subprocess.run(cmd)
-    cmd = ['cp', 'outputs/', '-r', hotspot_outdir]
-    subprocess.run(cmd, cwd=hotspot_running_dir)
-    print("[COOL-3D] Hotspot outputs copied to ", hotspot_outdir)
+    run_command(cmd)
+    if use_kernel and not extra_args:
+        os.makedirs(hotspot_outdir, exist_ok=True)
+        kernel_file = gen_thermal_kernel(inputs_dir, os.path.join(mcpat_outdir, 'coremem.ptrace'), hotspot_outdir, microfluidic_cooling, cache)
+        thermal_kernel.apply_kernel(
+            thermal_kernel.load_kernel(kernel_file),
+            os.path.join(mcpat_outdir, 'coremem.ptrace'),
+            os.path.join(hotspot_outdir, 'coremem.steady'),
+            os.path.join(hotspot_outdir, 'coremem.grid.steady')
+        )
+        print("[COOL-3D] Hotspot outputs computed from the thermal kernel at ", hotspot_outdir)
+        return
+    if use_kernel:
+        print("[COOL-3D] Thermal kernel only applies to steady simulations, running HotSpot")
+    if cache is not None:
+        key = make_key('hotspot', exec_stamp(os.path.join(hotspot_root, 'hotspot')), file_digest(os.path.join(mcpat_outdir, 'coremem.ptrace')), dir_digest(inputs_dir), microfluidic_cooling, extra_args, adaptive)
+        if cache.restore('hotspot', key, hotspot_outdir):
+            print("[COOL-3D] Hotspot outputs restored at ", hotspot_outdir)
+            return
+
+    # run hotspot in a private copy of the inputs, concurrent runs never share a directory
+    os.makedirs(hotspot_outdir, exist_ok=True)
+    if adaptive:
+        solve_adaptive_resolution(inputs_dir, os.path.join(mcpat_outdir, 'coremem.ptrace'), hotspot_outdir, microfluidic_cooling, extra_args, **adaptive)
+    else:
+        run_hotspot(
+            inputs_dir=inputs_dir,
+            ptrace=os.path.join(mcpat_outdir, 'coremem.ptrace'),
+            steady_file=os.path.join(hotspot_outdir, 'coremem.steady'),
+            grid_steady_file=os.path.join(hotspot_outdir, 'coremem.grid.steady'),
+            microfluidic_cooling=microfluidic_cooling,
+            extra_args=extra_args
+        )
+    if cache is not None:
+        cache.store('hotspot', key, [os.path.join(hotspot_outdir, name) for name in os.listdir(hotspot_outdir)])
+    print("[COOL-3D] Hotspot outputs generated at ", hotspot_outdir)
+
+def solve_adaptive_resolution(inputs_dir, ptrace, hotspot_outdir, microfluidic_cooling=False, extra_args=None, levels=None, tolerance=None, peak_threshold=None, order=2):
+    # Solve at increasing grid resolutions until the peak temperature is accurate enough for the question asked
+    # @inputs_dir: path to the input directory for HotSpot
+    # @ptrace: path to the power trace
+    # @hotspot_outdir: output directory, receives the outputs of the last level solved and resolution.json
+    # @microfluidic_cooling, @extra_args: see run_hotspot
+    # @levels: list of [rows, cols], coarse to fine
+    # @tolerance: float, stop once the estimated error of the peak temperature is below this many kelvins
+    # @peak_threshold: float, stop once the peak temperature is known to be above or below this temperature
+    # @order: int, convergence order of the discretization used for the error estimate
+    # return: dict, summary of the solve also written to hotspot_outdir/resolution.json
+
+    summary = {'levels': [], 'resolution': None, 'peak': None, 'error_estimate': None, 'verdict': 'finest'}
+    for i, grid in enumerate(levels):
+        level_dir = os.path.join(hotspot_outdir, 'levels', '%dx%d' % tuple(grid))
+        os.makedirs(level_dir, exist_ok=True)
+        run_hotspot(inputs_dir, ptrace, os.path.join(level_dir, 'coremem.steady'), os.path.join(level_dir, 'coremem.grid.steady'), microfluidic_cooling, extra_args, grid=grid)
+        peak = round(max(float(layer.max()) for layer in read_grid_steady(os.path.join(level_dir, 'coremem.grid.steady'))), 2)
+        # Richardson estimate of the error left at this level from the change since the previous one
+        error = None
+        if i > 0:
+            ratio = grid[0] / levels[i - 1][0]
+            error = round(abs(peak - summary['peak']) / (ratio ** order - 1), 3)
+        summary['levels'].append({'resolution': grid, 'peak': peak, 'error_estimate': error})
+        summary.update({'resolution': grid, 'peak': peak, 'error_estimate': error})
+        print("[COOL-3D] Hotspot peak temperature ", peak, " at resolution ", grid, ", estimated error ", error)
+        if error is None:
+            continue
+        if tolerance is not None and error <= tolerance:
+            summary['verdict'] = 'converged'
+            break
+        if peak_threshold is not None and peak - error > peak_threshold:
+            summary['verdict'] = 'above_threshold'
+            break
+        if peak_threshold is not None and peak + error < peak_threshold:
+            summary['verdict'] = 'below_threshold'
+            break
+
+    for name in ['coremem.steady', 'coremem.grid.steady']:
+        shutil.copy(os.path.join(level_dir, name), os.path.join(hotspot_outdir, name))
+    shutil.rmtree(os.path.join(hotspot_outdir, 'levels'), ignore_errors=True)
+    with open(os.path.join(hotspot_outdir, 'resolution.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    print("[COOL-3D] Hotspot stopped at resolution ", summary['resolution'], " (", summary['verdict'], ")")
+    return summary
 
-def visualize(hotspot_outdir, hotspot_inputs_dir, num_layers, resolution):
+def read_resolution(hotspot_outdir, resolution):
     # @hotspot_outdir: path to the hotspot outputs
-    # @num_layers: total number of layers in the 3D stack, including interposer and tim layers
+    # @resolution: [rows, cols], resolution of the config
+    # return: [rows, cols], resolution the outputs were solved at
+    resolution_file = os.path.join(hotspot_outdir, 'resolution.json')
+    if os.path.isfile(resolution_file):
+        with open(resolution_file) as f:
+            return json.load(f)['resolution']
+    return resolution
+
+def gen_thermal_kernel(inputs_dir, ptrace, hotspot_outdir, microfluidic_cooling=False, cache=None, jobs=None):
+    # Get the thermal response matrix of the stack in inputs_dir, built once per stack and kept in the result
+    # cache, or without one in a <inputs_dir>_thermal_kernels directory next to the stack inputs
+    # @inputs_dir: path to the input directory for HotSpot
+    # @ptrace: path to a power trace, only its header is used to get the powered blocks
+    # @hotspot_outdir: directory receiving thermal_kernel.npz
+    # @microfluidic_cooling: whether to enable microfluidic cooling
+    # @cache: utils.cache.ResultCache to reuse kernels across runs, None to keep them next to the stack inputs
+    # @jobs: int, maximum number of HotSpot solves in flight while building, default to the cpu count
+    # return: path to the kernel file
+
+    block_names, _ = read_ptrace(ptrace)
+    kernel_file = os.path.join(hotspot_outdir, 'thermal_kernel.npz')
+    if cache is None:
+        # a kernel costs a HotSpot solve per block, so it is kept even without a result cache, beside
+        # the inputs directory rather than in it as the digest of the directory is part of the key
+        cache = ResultCache(os.path.normpath(os.path.abspath(inputs_dir)) + '_thermal_kernels')
+
+    key = make_key('thermal_kernel', exec_stamp(os.path.join(os.environ['HOTSPOT_ROOT'], 'hotspot')), dir_digest(inputs_dir), microfluidic_cooling, block_names, thermal_kernel.UNIT_POWER)
+    # design points sharing a stack wait for the first one to build the kernel
+    with cache.lock('thermal_kernel', key):
+        if cache.restore('thermal_kernel', key, hotspot_outdir):
+            print("[COOL-3D] Thermal kernel restored at ", hotspot_outdir)
+            return kernel_file
+        build_thermal_kernel(inputs_dir, block_names, kernel_file, microfluidic_cooling, jobs=jobs)
+        cache.store('thermal_kernel', key, [kernel_file])
+    return kernel_file
+
+def build_thermal_kernel(inputs_dir, block_names, kernel_file, microfluidic_cooling=False, unit_power=thermal_kernel.UNIT_POWER, jobs=None):
+    # Build the thermal response matrix of a stack with one HotSpot solve per powered block plus one at zero power
+    # @inputs_dir: path to the input directory for HotSpot
+    # @block_names: list of the powered blocks, as in the header of the power traces
+    # @kernel_file: path to the output .npz file
+    # @microfluidic_cooling: whether to enable microfluidic cooling
+    # @unit_power: power in W of the powered block in each solve
+    # @jobs: int, maximum number of HotSpot solves in flight, default to the cpu count
+
+    work_dir = tempfile.mkdtemp(prefix='cool_3d_kernel_', dir=os.path.dirname(os.path.abspath(kernel_file)))
+
+    def solve(block_idx):
+        run_dir = os.path.join(work_dir, 'zero' if block_idx is None else 'block_%d' % block_idx)
+        os.makedirs(run_dir)
+        ptrace = os.path.join(run_dir, 'unit.ptrace')
+        thermal_kernel.write_unit_ptrace(block_names, block_idx, unit_power, ptrace)
+        run_hotspot(inputs_dir, ptrace, os.path.join(run_dir, 'unit.steady'), os.path.join(run_dir, 'unit.grid.steady'), microfluidic_cooling)
+        steady_names, steady = read_block_steady(os.path.join(run_dir, 'unit.steady'))
+        return steady_names, steady, read_grid_steady(os.path.join(run_dir, 'unit.grid.steady'))
+
+    print("[COOL-3D] Building thermal kernel with", len(block_names) + 1, "HotSpot solves")
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+            results = list(executor.map(in_context(solve), [None] + list(range(len(block_names)))))
+        thermal_kernel.save_kernel(thermal_kernel.assemble_kernel(block_names, results[0], results[1:], unit_power), kernel_file)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print("[COOL-3D] Thermal kernel built at ", kernel_file)
+
+def run_hotspot(inputs_dir, ptrace, steady_file, grid_steady_file, microfluidic_cooling=False, extra_args=None, grid=None):
+    # Run one HotSpot grid simulation in a unique temporary copy of the inputs directory
+    # @inputs_dir: path to the input directory for HotSpot
+    # @ptrace: path to the power trace
+    # @steady_file: path to the output block-level steady temperatures
+    # @grid_steady_file: path to the output grid-level steady temperatures
+    # @microfluidic_cooling: whether to enable microfluidic cooling
+    # @extra_args: list of additional HotSpot command line options
+    # @grid: [rows, cols], grid resolution overriding the one of the config file, microchannel geometries are rasterized to it
+
+    hotspot_exec = os.path.join(os.environ['HOTSPOT_ROOT'], 'hotspot')
+    # floorplans and microchannel geometries are referenced relative to the stack file,
+    # so HotSpot runs inside its own copy of the inputs
+    hotspot_running_dir = tempfile.mkdtemp(prefix='cool_3d_thermal_', dir=os.path.dirname(os.path.abspath(steady_file)))
+    try:
+        cmd = ['cp', '-r', os.path.join(inputs_dir, '.'), hotspot_running_dir]
+        run_command(cmd)
+        config = glob.glob(os.path.join(hotspot_running_dir, '*.config'))[0]
+        materials = glob.glob(os.path.join(hotspot_running_dir, '*.materials'))[0]
+        stack = glob.glob(os.path.join(hotspot_running_dir, '*.lcf'))[0]
+
+        cmd = [hotspot_exec,
+               '-p', os.path.abspath(ptrace),
+               '-c', config,
+               '-materials_file', materials,
+               '-grid_layer_file', stack,
+               '-model_type', 'grid',
+               '-detailed_3D', 'on',
+               '-steady_file', os.path.abspath(steady_file),
+               '-grid_steady_file', os.path.abspath(grid_steady_file)]
+        if microfluidic_cooling:
+            cmd += ['-use_microchannels', '1']
+        if grid is not None:
+            cmd += ['-grid_rows', str(grid[0]), '-grid_cols', str(grid[1])]
+            # the geometries are drawn cell by cell, so they have to match the grid
+            for csv_file in glob.glob(os.path.join(hotspot_running_dir, '**', '*.csv'), recursive=True):
+                if not rasterize_microchannels(csv_file, grid[0], grid[1]):
+                    print("[COOL-3D] Warning: ", os.path.basename(csv_file), " is rasterized coarser than drawn, channels may be lost at ", grid)
+        if extra_args:
+            cmd += extra_args
+        run_command(cmd, cwd=hotspot_running_dir)
+        print("[COOL-3D] Hotspot simulation done at ", hotspot_running_dir)
+    finally:
+        shutil.rmtree(hotspot_running_dir, ignore_errors=True)
+
+def convert_grid(hotspot_outdir, hotspot_inputs_dir, resolution):
+    # Convert the grid steady temperatures once into the binary grid read by all the later stages
+    # @hotspot_outdir: path to the hotspot outputs
+    # @hotspot_inputs_dir: path to the input directory for HotSpot
     # @resolution: 2-element list, resolution of the hotspot grid in x and y directions
+    # return: path to the binary grid
 
-    hotspot_root = os.environ['HOTSPOT_ROOT']
-    hotspot_scripts_dir = os.path.join(hotspot_root, 'scripts')
-    steady_trace = os.path.join(hotspot_outdir, 'coremem.grid.steady')
-
-    # split the traces for each layer
-    split_helper = os.path.join(hotspot_scripts_dir, 'split_grid_steady.py')
-    cmd = [split_helper, steady_trace, str(num_layers), str(resolution[0]), str(resolution[1])]
-    subprocess.run(cmd, cwd=hotspot_outdir)
-    print("[COOL-3D] Steady temperature trace split for each layer in ", hotspot_outdir)
-
-    # match the layers to the floorplans
-    stack_file = os.path.join(hotspot_inputs_dir, 'stack.lcf')
-    floorplan_list = match_layer(stack_file)
-
-    # visualize the temperature traces in the format of heat maps
-    for i, floorplan in enumerate(floorplan_list):
-        layer_name = os.path.basename(floorplan).split('.')[0]
-        cmd = [
-            'python3', 
-            os.path.join(hotspot_scripts_dir, 'grid_thermal_map.py'), 
-            os.path.join(hotspot_inputs_dir, floorplan),
-            os.path.join(hotspot_outdir, 'coremem_layer'+str(i)+'.grid.steady'),
-            str(resolution[0]), str(resolution[1]),
-            os.path.join(hotspot_outdir, 'layer'+str(i)+'_'+layer_name+'.png')
-        ]
-        subprocess.run(cmd)
-        print("[COOL-3D] Generating thermal map for layer ", i, " at ", os.path.join(hotspot_outdir, 'layer'+str(i)+layer_name+'.png'))
+    # an adaptive solve may stop before the resolution of the config
+    resolution = read_resolution(hotspot_outdir, resolution)
+    grid_file = os.path.join(hotspot_outdir, 'coremem.grid.npy')
+    floorplans = match_layer(os.path.join(hotspot_inputs_dir, 'stack.lcf'))
+    convert_grid_steady(os.path.join(hotspot_outdir, 'coremem.grid.steady'), resolution[0], resolution[1], grid_file, floorplans)
+    print("[COOL-3D] Binary thermal grid written at ", grid_file)
+    return grid_file
+
+def gen_thermal_metrics(hotspot_outdir, hotspot_inputs_dir, threshold=HOTSPOT_THRESHOLD):
+    # Compute peak, mean, P99, max gradient and hotspot area per layer and per block from the binary grid
+    # @hotspot_outdir: path to the hotspot outputs, with the binary grid of convert_grid
+    # @hotspot_inputs_dir: path to the input directory for HotSpot
+    # @threshold: float, temperature in K above which a cell is part of a hotspot
+    # return: path to metrics.json
+
+    metrics_file = os.path.join(hotspot_outdir, 'metrics.json')
+    metrics = write_metrics(os.path.join(hotspot_outdir, 'coremem.grid.npy'), hotspot_inputs_dir, metrics_file, threshold)
+    print("[COOL-3D] Peak temperature ", metrics['summary']['peak'], " K in layer ", metrics['summary']['peak_layer'])
+    print("[COOL-3D] Thermal metrics written at ", metrics_file)
+    return metrics_file
+
+def visualize(hotspot_outdir, hotspot_inputs_dir, num_layers, cache=None):
+    # @hotspot_outdir: path to the hotspot outputs, with the binary grid of convert_grid
+    # @hotspot_inputs_dir: path to the input directory for HotSpot
+    # @num_layers: total number of layers in the 3D stack, including interposer and tim layers
+    # @cache: utils.cache.ResultCache to reuse results of identical runs, None to disable
+
+    grid_file = os.path.join(hotspot_outdir, 'coremem.grid.npy')
+    if cache is not None:
+        key = make_key('visualize', file_digest(grid_file), dir_digest(hotspot_inputs_dir), num_layers)
+        if cache.restore('visualize', key, hotspot_outdir):
+            print("[COOL-3D] Thermal maps restored at ", hotspot_outdir)
+            return
+
+    # the layers are zero-copy slices of the memory-mapped grid, matched to their floorplans by the grid header
+    grid, header = load_grid(grid_file)
+    floorplan_list = header['floorplans'][:int(num_layers)]
+    thermal_maps = render_thermal_maps(grid, [os.path.join(hotspot_inputs_dir, floorplan) for floorplan in floorplan_list], hotspot_outdir)
+    for i, thermal_map in enumerate(thermal_maps):
+        print("[COOL-3D] Generating thermal map for layer ", i, " at ", thermal_map)
+
+    if cache is not None:
+        cache.store('visualize', key, thermal_maps)
+
+# McPAT and CACTI-3DD model leakage at temperatures from 300K to 400K in steps of 10K
+LEAKAGE_TEMPERATURES = list(range(300, 410, 10))
+
+def leakage_feedback(gem5_outdir, mcpat_outdir, cacti_in, cacti_outdir, inputs_dir, is_core_list, banks_per_layer, hotspot_outdir,
+                     microfluidic_cooling=False, cache=None, use_kernel=False, layer_temperature='mean', tolerance=0.5, max_iterations=10, adaptive=None):
+    # Iterate HotSpot with the core and memory leakage evaluated at the temperatures HotSpot finds, until they settle
+    # @gem5_outdir: path to the gem5 output directory
+    # @mcpat_outdir: path to the McPAT output directory of the first pass, mcpat_in.xml is reused
+    # @cacti_in: path to the CACTI-3DD input file
+    # @cacti_outdir: path to the CACTI-3DD output directory of the first pass
+    # @inputs_dir, @is_core_list, @banks_per_layer, @microfluidic_cooling, @cache, @use_kernel, @adaptive: see gen_temperature_trace
+    # @hotspot_outdir: path to the HotSpot output directory of the first pass, overwritten by every iteration
+    # @layer_temperature: 'mean' or 'peak', temperature of a layer used for its leakage
+    # @tolerance: float, stop once no layer temperature moves by more than this many kelvins
+    # @max_iterations: int, maximum number of HotSpot runs in the loop
+    # return: list of dict, layer temperatures of every iteration, also written to hotspot_outdir/leakage.json
+
+    leakage_dir = os.path.join(mcpat_outdir, 'leakage')
+    os.makedirs(leakage_dir, exist_ok=True)
+    power_layers = match_power_layers(os.path.join(inputs_dir, 'stack.lcf'))
+    if len(power_layers) != len(is_core_list):
+        raise ValueError("%d power dissipating layers in the stack but is_core_list has %d" % (len(power_layers), len(is_core_list)))
+    # the core leakage is evaluated at the hottest core layer
+    if '1' not in is_core_list:
+        raise ValueError("No core layer in is_core_list " + is_core_list + ", the leakage feedback needs one")
+    banks_per_layer = int(banks_per_layer)
+    # the bank leakage is given per memory layer, it must cover every bank of the memory power trace
+    gem5_config, gem5_stats = read_gem5_outputs(gem5_outdir)
+    num_mem_layers = len(is_core_list) - is_core_list.count('1')
+    if num_mem_layers * banks_per_layer != dram_bank_count(gem5_config):
+        raise ValueError("%d memory layers of %d banks in the stack but gem5 simulated %d banks" % (num_mem_layers, banks_per_layer, dram_bank_count(gem5_config)))
+
+    # the dynamic power does not depend on the temperature, so each McPAT and CACTI-3DD run
+    # below only differs from the first pass by its leakage, and is cached per temperature step
+    mcpat_traces = {}
+    cacti_leakages = {}
+    def core_trace(temperature):
+        if temperature not in mcpat_traces:
+            run_dir = os.path.join(leakage_dir, 'mcpat_%dK' % temperature)
+            os.makedirs(run_dir, exist_ok=True)
+            set_mcpat_temperature(os.path.join(mcpat_outdir, 'mcpat_in.xml'), temperature, os.path.join(run_dir, 'mcpat_in.xml'))
+            run_mcpat(os.path.join(run_dir, 'mcpat_in.xml'), run_dir, cache)
+            names, rows = read_core_ptrace(os.path.join(run_dir, 'mcpat_out.ptrace'))
+            mcpat_traces[temperature] = (names, np.array(rows, dtype=float))
+        return mcpat_traces[temperature]
+    def bank_leakage(temperature):
+        if temperature not in cacti_leakages:
+            run_dir = os.path.join(leakage_dir, 'cacti_%dK' % temperature)
+            cacti_cfg = run_dir + '.cfg'
+            write_cacti_cfg(cacti_in, cacti_cfg, {'operating temperature (K)': str(temperature)})
+            cacti_leakages[temperature] = read_cacti_leakage(run_cacti(cacti_cfg, run_dir, cache))
+        return cacti_leakages[temperature]
+
+    history = []
+    previous = None
+    for iteration in range(max_iterations):
+        temperatures = read_layer_temperatures(os.path.join(hotspot_outdir, 'coremem.grid.steady'), power_layers, layer_temperature)
+        history.append({'iteration': iteration, 'layer_temperatures': temperatures})
+        print("[COOL-3D] Leakage feedback iteration", iteration, "layer temperatures", temperatures)
+        if previous is not None and max(abs(t - p) for t, p in zip(temperatures, previous)) <= tolerance:
+            break
+        previous = temperatures
+
+        # one McPAT model for all the core layers, evaluated at the hottest of them
+        core_temperature = max(t for t, is_core in zip(temperatures, is_core_list) if is_core == '1')
+        names, rows = interpolate_leakage(core_trace, core_temperature)
+        with open(os.path.join(leakage_dir, 'mcpat_out.ptrace'), 'w') as f:
+            f.write('\t'.join(names) + '\n')
+            for row in rows:
+                f.write('\t'.join('%.6f' % value for value in row) + '\n')
+        leakage = []
+        for temperature, is_core in zip(temperatures, is_core_list):
+            if is_core != '1':
+                leakage += [interpolate_leakage(bank_leakage, temperature)] * banks_per_layer
+        cacti_out = os.path.join(cacti_outdir, os.path.basename(cacti_in) + ".out")
+        gen_mem_ptrace(None, None, cacti_out, os.path.join(leakage_dir, 'mem.ptrace'), gem5_config=gem5_config, gem5_stats=gem5_stats, bank_leakage=leakage)
+
+        gen_temperature_trace(leakage_dir, leakage_dir, inputs_dir, is_core_list, banks_per_layer, hotspot_outdir,
+                              microfluidic_cooling=microfluidic_cooling, cache=cache, use_kernel=use_kernel, adaptive=adaptive)
+    else:
+        temperatures = read_layer_temperatures(os.path.join(hotspot_outdir, 'coremem.grid.steady'), power_layers, layer_temperature)
+        history.append({'iteration': max_iterations, 'layer_temperatures': temperatures})
+        print("[COOL-3D] Leakage feedback did not converge in", max_iterations, "iterations")
+
+    with open(os.path.join(hotspot_outdir, 'leakage.json'), 'w') as f:
+        json.dump(history, f, indent=2)
+    print("[COOL-3D] Leakage feedback done at ", hotspot_outdir)
+    return history
+
+def interpolate_leakage(evaluate, temperature):
+    # Linearly interpolate a leakage dependent result between the two closest supported temperatures
+    # @evaluate: function of a temperature in LEAKAGE_TEMPERATURES returning a float or (names, numpy array)
+    # @temperature: float, in kelvins, clamped to the supported range
+    temperature = min(max(temperature, LEAKAGE_TEMPERATURES[0]), LEAKAGE_TEMPERATURES[-1])
+    low = max(t for t in LEAKAGE_TEMPERATURES if t <= temperature)
+    high = min(t for t in LEAKAGE_TEMPERATURES if t >= temperature)
+    weight = 0 if high == low else (temperature - low) / (high - low)
+    low_result, high_result = evaluate(low), evaluate(high)
+    if isinstance(low_result, tuple):
+        return low_result[0], (1 - weight) * low_result[1] + weight * high_result[1]
+    return (1 - weight) * low_result + weight * high_result
+
+def set_mcpat_temperature(mcpat_in, temperature, output_file):
+    # Copy a McPAT input xml with the system temperature replaced
+    with open(mcpat_in) as f:
+        xml = f.read()
+    xml, count = re.subn(r'(<param name="temperature" value=")[^"]*(")', r'\g<1>%d\g<2>' % temperature, xml, count=1)
+    if count == 0:
+        raise ValueError("No temperature parameter found in " + mcpat_in)
+    with open(output_file, 'w') as f:
+        f.write(xml)
+
+def read_layer_temperatures(grid_steady_file, layers, layer_temperature='mean'):
+    # @grid_steady_file: path to a HotSpot grid steady file
+    # @layers: list of layer indices in the stack
+    # @layer_temperature: 'mean' or 'peak'
+    # return: list of float, temperature of each layer
+    grid = read_grid_steady(grid_steady_file)
+    if layer_temperature == 'peak':
+        return [round(float(grid[layer].max()), 2) for layer in layers]
+    return [round(float(grid[layer].mean()), 2) for layer in layers]
+
+def match_power_layers(stack_file):
+    # @stack_file: path to the stacking file
+    # return: list of indices of the layers dissipating power, bottom up
+
+    layers = []
+    with open(stack_file, 'r') as f:
+        for line in f:
+            if line.startswith('#') or line.startswith('\n'):
+                continue
+            layer_idx = int(line.strip())
+            f.readline()
+            if f.readline().strip() == 'Y':
+                layers.append(layer_idx)
+            # skip the rest of the layer, layers are separated by blank lines
+            for line in f:
+                if not line.strip():
+                    break
+    return layers
 
 def match_layer(stack_file):
     # @stack_file: path to the stacking file
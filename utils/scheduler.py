@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import subprocess
+import contextlib
+import contextvars
+import concurrent.futures
+
+from utils.cache import file_digest, make_key
+
+class Stage:
+    # A single step of the Cool-3D pipeline
+    # @name: str, unique name of the stage
+    # @func: callable that performs the stage
+    # @inputs: list of files the stage reads
+    # @outputs: list of files the stage produces
+    # @kwargs: keyword arguments passed to func
+
+    def __init__(self, name, func, inputs=None, outputs=None, **kwargs):
+        self.name = name
+        self.func = func
+        self.inputs = [os.path.abspath(path) for path in (inputs or [])]
+        self.outputs = [os.path.abspath(path) for path in (outputs or [])]
+        self.kwargs = kwargs
+        self.deps = set()
+        # wall time of the last run in seconds, None if the stage has not run
+        self.elapsed = None
+
+    def params_key(self):
+        # return: digest of the plain-data keyword arguments, objects such as caches do not affect the results
+        params = {key: value for key, value in self.kwargs.items() if isinstance(value, (str, int, float, bool, list, dict, type(None)))}
+        return make_key(self.name, params)
+
+    def run(self):
+        # outputs left by a previous run must not pass for fresh ones
+        for path in self.outputs:
+            if os.path.isfile(path):
+                os.remove(path)
+        start = time.time()
+        try:
+            result = self.func(**self.kwargs)
+        finally:
+            self.elapsed = time.time() - start
+        # later stages must not consume stale or missing files
+        missing = [path for path in self.outputs if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError("Stage " + self.name + " did not produce " + ', '.join(missing))
+        return result
+
+def resolve_deps(stages):
+    # @stages: list<Stage>
+    # a stage depends on every other stage that produces one of its inputs
+
+    producers = {}
+    names = set()
+    for stage in stages:
+        if stage.name in names:
+            raise ValueError("Duplicated stage name " + stage.name)
+        names.add(stage.name)
+        for output in stage.outputs:
+            if output in producers:
+                raise ValueError("Output " + output + " is produced by both " + producers[output] + " and " + stage.name)
+            producers[output] = stage.name
+    for stage in stages:
+        stage.deps = set(producers[path] for path in stage.inputs if path in producers and producers[path] != stage.name)
+
+    # reject cycles before anything is launched
+    visited = {}
+    by_name = {stage.name: stage for stage in stages}
+    def visit(name):
+        if visited.get(name) == 'done':
+            return
+        if visited.get(name) == 'visiting':
+            raise ValueError("Stage dependency cycle detected at " + name)
+        visited[name] = 'visiting'
+        for dep in by_name[name].deps:
+            visit(dep)
+        visited[name] = 'done'
+    for stage in stages:
+        visit(stage.name)
+
+def marker_file(state_dir, name):
+    return os.path.join(state_dir, name + '.json')
+
+def read_marker(state_dir, name):
+    # return: dict, completion marker of a stage, None if there is none
+    try:
+        with open(marker_file(state_dir, name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_marker(state_dir, name, marker):
+    # written to a temporary file and renamed, so a crash never leaves a partial marker behind
+    path = marker_file(state_dir, name)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(marker, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def digest_files(paths):
+    # return: dict<path, sha256 digest>, None for missing files
+    return {path: file_digest(path) if os.path.isfile(path) else None for path in paths}
+
+def is_complete(stage, state_dir, producers):
+    # A stage is complete if it finished successfully with the same parameters, its outputs are still
+    # there and it consumed the inputs that are current now: the outputs recorded by the marker of the
+    # producing stage, or the file on disk for inputs produced outside the pipeline. Comparing with the
+    # producer's marker rather than the file keeps stages rewriting their inputs in place complete.
+    # @producers: dict<output path, name of the stage producing it>
+    marker = read_marker(state_dir, stage.name)
+    if marker is None or marker.get('status') != 'done' or marker.get('params') != stage.params_key():
+        return False
+    if not all(os.path.exists(path) for path in stage.outputs):
+        return False
+    for path in stage.inputs:
+        if path in producers:
+            producer = read_marker(state_dir, producers[path])
+            current = producer['outputs'].get(path) if producer else None
+        else:
+            current = file_digest(path) if os.path.isfile(path) else None
+        if marker['inputs'].get(path) != current:
+            return False
+    return True
+
+def run_tracked(stage, state_dir):
+    # Run a stage, replacing its completion marker by one recording the input hashes and exit status
+    path = marker_file(state_dir, stage.name)
+    if os.path.exists(path):
+        os.remove(path)
+    marker = {'stage': stage.name, 'params': stage.params_key(), 'inputs': digest_files(stage.inputs), 'started': time.time()}
+    try:
+        result = stage.run()
+    except Exception as exc:
+        marker.update(status='failed', exit_status=exc.returncode if isinstance(exc, subprocess.CalledProcessError) else 1, error=repr(exc))
+        write_marker(state_dir, stage.name, marker)
+        raise
+    marker.update(status='done', exit_status=0, outputs=digest_files(stage.outputs), elapsed=round(stage.elapsed, 3))
+    write_marker(state_dir, stage.name, marker)
+    return result
+
+def launch(stage, state_dir=None, trace=None):
+    # Run a stage in a worker thread, with its completion marker and timings if enabled
+    with trace.span(stage.name) if trace is not None else contextlib.nullcontext():
+        if state_dir is not None:
+            return run_tracked(stage, state_dir)
+        return stage.run()
+
+def run_stages(stages, max_workers=None, state_dir=None, resume=False, trace=None):
+    # Run the stages as a DAG, launching every stage whose dependencies are done
+    # @stages: list<Stage>
+    # @max_workers: maximum number of stages running at the same time, default to the number of stages
+    # @state_dir: directory of the stage completion markers, None to run without them
+    # @resume: skip the stages whose marker shows they are complete, see is_complete
+    # @trace: utils.timing.Trace recording the timings of the stages, None to disable
+    # return: dict<stage name, return value of the stage>, None for skipped stages
+
+    resolve_deps(stages)
+    pending = {stage.name: stage for stage in stages}
+    done = {}
+    failed = None
+    if not max_workers:
+        max_workers = max(len(stages), 1)
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    if state_dir is not None:
+        os.makedirs(state_dir, exist_ok=True)
+
+    # stages spend their time in external simulators, so threads are enough to overlap them
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        while pending or running:
+            launched = True
+            while failed is None and launched:
+                launched = False
+                for name in list(pending):
+                    stage = pending[name]
+                    if stage.deps.issubset(done.keys()):
+                        del pending[name]
+                        launched = True
+                        # completeness is checked once the dependencies are settled, so a rerun
+                        # upstream stage changing its outputs invalidates this one
+                        if resume and state_dir is not None and is_complete(stage, state_dir, producers):
+                            print("[COOL-3D] Stage", name, "already complete, skipped")
+                            done[name] = None
+                            continue
+                        print("[COOL-3D] Stage", name, "started")
+                        # every stage gets its own context, holding its timing span
+                        running[executor.submit(contextvars.copy_context().run, launch, stage, state_dir, trace)] = name
+            if not running:
+                break
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    done[name] = future.result()
+                    print("[COOL-3D] Stage", name, "finished")
+                except Exception as exc:
+                    print("[COOL-3D] Error: Stage", name, "failed with", repr(exc))
+                    if failed is None:
+                        failed = exc
+
+    if failed is not None:
+        print("[COOL-3D] Skipped stages:", ', '.join(sorted(pending)))
+        raise failed
+
+    return done
@@ -0,0 +1,117 @@
+import os
+import re
+import pickle
+import logging
+
+# bump when the layout of the parsed stats changes to invalidate old index files
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.idx'
+
+ignores = re.compile(r'^---|^$')
+begin_epoch = re.compile(r'^-+\s*Begin Simulation Statistics\s*-+')
+end_epoch = re.compile(r'^-+\s*End Simulation Statistics\s*-+')
+stat_line = re.compile(r'([a-zA-Z0-9_\.:-]+)\s+([-+]?[0-9]+\.[0-9]+|[-+]?[0-9]+|nan|inf)')
+
+def parse_value(token):
+    # @token: str, value column of a stats.txt line
+    # return: int for integral values, float otherwise
+    try:
+        return int(token)
+    except ValueError:
+        return float(token)
+
+def parse_stats(stats_file):
+    # @stats_file: path to a gem5 stats.txt
+    # return: dict<stat name, int or float> in file order, later dumps override earlier ones
+
+    stats = {}
+    with open(stats_file) as f:
+        for count, line in enumerate(f, 1):
+            # ignore empty lines and lines starting with "---"
+            if ignores.match(line):
+                continue
+            match = stat_line.match(line)
+            if match:
+                stat_key = match.group(1)
+                stat_val = match.group(2)
+                if stat_val == 'nan':
+                    logging.warning("%s is nan. Setting it to 0" % stat_key)
+                    stat_val = '0'
+                stats[stat_key] = parse_value(stat_val)
+            else:
+                logging.warning(f"Line {count} did not match the expected format: {line.strip()}")
+    return stats
+
+def iter_stats_epochs(stats_file):
+    # Stream a gem5 stats.txt with periodic dumps, one block at a time
+    # @stats_file: path to a gem5 stats.txt
+    # return: generator of dict<stat name, int or float>, one per "Begin Simulation Statistics" block
+
+    stats = None
+    with open(stats_file) as f:
+        for line in f:
+            if begin_epoch.match(line):
+                stats = {}
+                continue
+            if end_epoch.match(line):
+                if stats is not None:
+                    yield stats
+                stats = None
+                continue
+            if stats is None or ignores.match(line):
+                continue
+            match = stat_line.match(line)
+            if match:
+                stat_val = match.group(2)
+                if stat_val == 'nan':
+                    stat_val = '0'
+                stats[match.group(1)] = parse_value(stat_val)
+    # a dump cut short by a crashed or still running simulation
+    if stats:
+        yield stats
+
+def has_interval(stats):
+    # @stats: dict of one stats dump
+    # return: bool, the dump covers a simulated interval, dumps without simSeconds or with a zero one carry no power
+    return bool(stats.get('simSeconds'))
+
+def iter_timed_epochs(stats_file):
+    # The stats dumps of iter_stats_epochs that cover a simulated interval, every per-dump trace
+    # (core power, memory power, HotSpot sampling interval) is built from these so that their rows line up
+    # @stats_file: path to a gem5 stats.txt
+    # return: generator of dict<stat name, int or float>
+    return (stats for stats in iter_stats_epochs(stats_file) if has_interval(stats))
+
+def index_stamp(stats_file):
+    st = os.stat(stats_file)
+    return [INDEX_VERSION, st.st_mtime_ns, st.st_size]
+
+def load_stats(stats_file, use_index=True):
+    # Load a gem5 stats.txt, reusing the binary index stored next to it when it is up to date
+    # @stats_file: path to a gem5 stats.txt
+    # @use_index: bool, read and write <stats_file>.idx
+    # return: dict<stat name, int or float>
+
+    if not use_index:
+        return parse_stats(stats_file)
+
+    index_file = stats_file + INDEX_SUFFIX
+    stamp = index_stamp(stats_file)
+    try:
+        with open(index_file, 'rb') as f:
+            index = pickle.load(f)
+        if index['stamp'] == stamp:
+            return index['stats']
+    except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+        pass
+
+    stats = parse_stats(stats_file)
+    # write to a temp file and rename so concurrent readers never see a partial index
+    tmp_file = index_file + '.' + str(os.getpid())
+    try:
+        with open(tmp_file, 'wb') as f:
+            pickle.dump({'stamp': stamp, 'stats': stats}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, index_file)
+    except OSError:
+        logging.warning("Failed to write stats index " + index_file)
+    return stats
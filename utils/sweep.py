@@ -0,0 +1,169 @@
+import os
+import csv
+import json
+import copy
+import time
+import random
+import itertools
+import traceback
+import concurrent.futures
+
+import utils.run as run
+import utils.parse_input as parse_input
+from utils.timing import trace_events, write_trace_events
+
+# sections of inputs.yaml whose values may be given as lists to sweep over
+SWEEP_SECTIONS = ['arch', 'thermal']
+
+def find_sweep_params(inputs):
+    # @inputs: dict, raw content of a top level yaml input file
+    # return: list of (section, key, list<values>) for every swept parameter
+
+    params = []
+    for section in SWEEP_SECTIONS:
+        for key, value in (inputs.get(section) or {}).items():
+            if isinstance(value, list):
+                if len(value) == 0:
+                    print("[COOL-3D] Error: Empty value list for ", section + "." + key)
+                    exit(1)
+                params.append((section, key, value))
+    return params
+
+def cartesian_points(params):
+    # return: list of tuples, one value per swept parameter
+    return list(itertools.product(*[values for _, _, values in params]))
+
+def latin_hypercube_points(params, samples, seed=None):
+    # Latin hypercube sampling over the value lists: every parameter's list is
+    # split into @samples equal strata and each stratum is used exactly once
+    # return: list of tuples, one value per swept parameter
+
+    rng = random.Random(seed)
+    columns = []
+    for _, _, values in params:
+        strata = list(range(samples))
+        rng.shuffle(strata)
+        columns.append([values[min(int((stratum + rng.random()) / samples * len(values)), len(values) - 1)] for stratum in strata])
+    return list(zip(*columns))
+
+def expand_design_points(inputs):
+    # @inputs: dict, raw content of a top level yaml input file
+    # return: list of (dict<'section.key', value>, dict<inputs of the design point>)
+
+    params = find_sweep_params(inputs)
+    sweep = inputs.get('sweep') or {}
+    method = sweep.get('method', 'cartesian')
+    if method == 'cartesian':
+        values = cartesian_points(params)
+    elif method in ['lhs', 'latin_hypercube']:
+        if not sweep.get('samples'):
+            print("[COOL-3D] Error: Number of samples not found for latin hypercube sweep")
+            exit(1)
+        values = latin_hypercube_points(params, int(sweep['samples']), sweep.get('seed'))
+    else:
+        print("[COOL-3D] Error: Unknown sweep method ", method)
+        exit(1)
+
+    points = []
+    for point_values in values:
+        point_inputs = copy.deepcopy(inputs)
+        point_inputs.pop('sweep', None)
+        point = {}
+        for (section, key, _), value in zip(params, point_values):
+            point_inputs[section][key] = value
+            point[section + '.' + key] = value
+        points.append((point, point_inputs))
+    return points
+
+def run_design_point(point_id, config, workload, outdir, max_workers=None, use_cache=True, inputs=None, results_db=True, resume=False, trace=False):
+    # Run the whole pipeline for one design point, in a worker process
+    # @inputs: dict, inputs of the design point, registered with the run in the results database
+    # return: dict, status of the run
+
+    start = time.time()
+    status = 'done'
+    try:
+        run.run(config, workload, outdir, max_workers=max_workers, use_cache=use_cache, inputs=inputs, results_db=results_db, resume=resume, trace=trace)
+    except Exception:
+        traceback.print_exc()
+        status = 'failed'
+    row = {'point': point_id, 'status': status, 'elapsed_s': round(time.time() - start, 3), 'outdir': outdir}
+    # the thermal summary lets the sweep be ranked from the table alone
+    metrics_file = os.path.join(outdir, 'thermal', 'metrics.json')
+    if status == 'done' and os.path.isfile(metrics_file):
+        with open(metrics_file) as f:
+            row.update(json.load(f)['summary'])
+    return row
+
+def run_sweep(inputs, input_file, jobs=None, max_workers=None, use_cache=True, results_db=True, resume=False, trace=False):
+    # @inputs: dict, raw content of a top level yaml input file with swept values
+    # @input_file: str, path to the yaml input file
+    # @jobs: int, number of design points simulated concurrently, default to sweep.jobs or the cpu count
+    # @max_workers: int, maximum number of stages running concurrently in each design point
+    # @use_cache: bool, reuse stage results of previous runs with identical inputs
+    # @results_db: bool, register every design point in the results database
+    # @resume: skip the stages of every design point completed by a previous sweep
+    # @trace: write the stage timings of all the design points as one Chrome trace_event file
+    # return: list of dict, one result row per design point
+
+    points = expand_design_points(inputs)
+    sweep = inputs.get('sweep') or {}
+    if jobs is None:
+        jobs = sweep.get('jobs') or os.cpu_count()
+    print("[COOL-3D] Sweeping", len(points), "design points with", jobs, "workers")
+
+    # validate every design point before launching any simulation
+    runs = []
+    for i, (point, point_inputs) in enumerate(points):
+        config, workload, outdir = parse_input.parse_inputs(point_inputs, input_file)
+        point_outdir = os.path.join(outdir, 'point_%04d' % i)
+        runs.append((i, point, point_inputs, config, workload, point_outdir))
+    sweep_outdir = outdir if points else None
+
+    rows = [None] * len(runs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        for i, point, point_inputs, config, workload, point_outdir in runs:
+            futures[executor.submit(run_design_point, i, config, workload, point_outdir, max_workers, use_cache, point_inputs, results_db, resume, trace)] = (i, point)
+        for future in concurrent.futures.as_completed(futures):
+            i, point = futures[future]
+            row = future.result()
+            row.update(point)
+            rows[i] = row
+            print("[COOL-3D] Design point", i, row['status'], "in", row['elapsed_s'], "s")
+
+    if sweep_outdir is not None:
+        write_results_table(rows, os.path.join(sweep_outdir, 'sweep_results.csv'))
+        if trace:
+            write_sweep_trace(runs, os.path.join(sweep_outdir, 'sweep_trace.json'))
+    return rows
+
+def write_sweep_trace(runs, output_file):
+    # Merge the timings of the design points into one trace, one viewer process per design point
+    # @runs: list of (point id, point, inputs, config, workload, outdir)
+    # @output_file: str, path to the trace_event json
+
+    events = []
+    for i, _, _, _, _, point_outdir in runs:
+        timings_file = os.path.join(point_outdir, 'timings.json')
+        if os.path.isfile(timings_file):
+            with open(timings_file) as f:
+                events += trace_events(json.load(f), pid=i, label=os.path.basename(point_outdir))
+    write_trace_events(events, output_file)
+    print("[COOL-3D] Sweep trace written to ", output_file)
+
+def write_results_table(rows, output_file):
+    # @rows: list of dict, one result row per design point
+    # @output_file: str, path to the consolidated csv table
+
+    fields = []
+    for row in rows:
+        for field in row:
+            if field not in fields:
+                fields.append(field)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    print("[COOL-3D] Sweep results written to ", output_file)
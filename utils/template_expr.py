@@ -0,0 +1,97 @@
+import re
+import ast
+import logging
+
+try:
+    from utils.stats import parse_value
+except ImportError:  # run as a script from the utils directory
+    from stats import parse_value
+
+# McPAT template values may be arithmetic over gem5 results, e.g. value="stats.system.cpu.numCycles / 2"
+# or value="config.system.cpu.0.issueWidth,2". Every distinct value string is parsed once into a
+# compiled expression over placeholder names and evaluated against the stats of each snapshot,
+# instead of substituting the references textually and running eval on the result every time.
+
+reference_patterns = {
+    'stats': re.compile(r'(?<![\w.])stats\.([a-zA-Z0-9_:\.]+)'),
+    'config': re.compile(r'(?<![\w.])config\.([][a-zA-Z0-9_:\.]+)'),
+}
+
+# the only names an expression may call
+FUNCTIONS = {'min': min, 'max': max, 'abs': abs, 'round': round, 'int': int, 'float': float}
+
+ALLOWED_NODES = (
+    ast.Expression, ast.Tuple, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+    ast.Call, ast.Name, ast.Load, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.USub, ast.UAdd, ast.Not, ast.And, ast.Or,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+)
+
+class TemplateExpression:
+    # A template value compiled once, a comma separated list of expressions over stats.* or config.* references
+    # @source: str, the template value
+    # @namespace: 'stats' or 'config', the references resolved by evaluate
+
+    def __init__(self, source, namespace):
+        self.source = source
+        self.namespace = namespace
+        self.refs = []
+        placeholders = {}
+
+        def placeholder(match):
+            path = match.group(1)
+            if path not in placeholders:
+                placeholders[path] = '_ref%d' % len(self.refs)
+                self.refs.append(path)
+            return placeholders[path]
+
+        expr = reference_patterns[namespace].sub(placeholder, source)
+        # references to the other namespace are resolved by another pass, if ever
+        other = 'config' if namespace == 'stats' else 'stats'
+        self.resolvable = reference_patterns[other].search(expr) is None
+        self.codes = []
+        if not self.resolvable:
+            return
+        try:
+            tree = ast.parse(expr.strip(), mode='eval')
+        except SyntaxError as exc:
+            raise ValueError("Invalid template expression '%s': %s" % (source, exc.msg))
+        names = set(placeholders.values())
+        for node in ast.walk(tree):
+            if not isinstance(node, ALLOWED_NODES):
+                raise ValueError("Unsupported %s in template expression '%s'" % (type(node).__name__, source))
+            if isinstance(node, ast.Name) and node.id not in names and node.id not in FUNCTIONS:
+                raise ValueError("Unknown name %s in template expression '%s'" % (node.id, source))
+            if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords):
+                raise ValueError("Unsupported call in template expression '%s'" % source)
+        parts = tree.body.elts if isinstance(tree.body, ast.Tuple) else [tree.body]
+        for part in parts:
+            self.codes.append(compile(ast.fix_missing_locations(ast.Expression(body=part)), '<template>', 'eval'))
+
+    def evaluate(self, lookup):
+        # @lookup: callable mapping a reference path to its value, None if it does not exist
+        # return: str, the comma separated values, None if a reference is missing or the value is not resolvable here
+
+        if not self.resolvable:
+            return None
+        values = {}
+        for i, path in enumerate(self.refs):
+            value = lookup(path)
+            if value is None:
+                return None
+            # stats are kept as the strings of stats.txt
+            values['_ref%d' % i] = parse_value(value) if isinstance(value, str) and self.namespace == 'stats' else value
+        return ','.join(str(eval(code, {'__builtins__': {}, **FUNCTIONS}, values)) for code in self.codes)
+
+# compiled expressions, keyed on (namespace, value), shared by every template and snapshot
+compiled = {}
+
+def compile_value(value, namespace):
+    # @value: str, a template param or stat value
+    # @namespace: 'stats' or 'config'
+    # return: TemplateExpression, None if the value has no reference to the namespace
+    key = (namespace, value)
+    if key not in compiled:
+        compiled[key] = TemplateExpression(value, namespace) if reference_patterns[namespace].search(value) else None
+    return compiled[key]
@@ -0,0 +1,127 @@
+import os
+import json
+
+import numpy as np
+
+def read_grid_steady(grid_steady_file):
+    # @grid_steady_file: path to a HotSpot grid steady file, 'Layer <n>:' headers followed by '<cell>\t<temperature>' lines
+    # return: list of numpy arrays, temperatures of the grid cells of each layer in row-major order
+
+    layers = []
+    temps = []
+    with open(grid_steady_file) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('Layer'):
+                if temps:
+                    layers.append(np.array(temps))
+                temps = []
+                continue
+            temps.append(float(line.split()[-1]))
+    if temps:
+        layers.append(np.array(temps))
+    return layers
+
+def write_grid_steady(layers, grid_steady_file):
+    # @layers: list of numpy arrays, temperatures of the grid cells of each layer in row-major order
+    # @grid_steady_file: path to the output file, in the format written by HotSpot
+
+    with open(grid_steady_file, 'w') as f:
+        for n, temps in enumerate(layers):
+            f.write('Layer %d:\n' % n)
+            for i, temp in enumerate(temps):
+                f.write('%d\t%.2f\n' % (i, temp))
+            f.write('\n')
+
+def read_block_steady(steady_file):
+    # @steady_file: path to a HotSpot block steady file, '<block>\t<temperature>' lines
+    # return: list of block names, numpy array of block temperatures
+
+    names = []
+    temps = []
+    with open(steady_file) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) != 2:
+                continue
+            names.append(fields[0])
+            temps.append(float(fields[1]))
+    return names, np.array(temps)
+
+def write_block_steady(names, temps, steady_file):
+    # @names: list of block names
+    # @temps: numpy array of block temperatures
+    # @steady_file: path to the output file, in the format written by HotSpot
+
+    with open(steady_file, 'w') as f:
+        for name, temp in zip(names, temps):
+            f.write('%s\t%.2f\n' % (name, temp))
+
+def resample_grid(values, rows, cols):
+    # Rasterize a 2D grid at another resolution, every target cell takes the value of the source cell under its center
+    # @values: 2D numpy array
+    # return: numpy array of shape (rows, cols)
+
+    src_rows, src_cols = values.shape
+    row_idx = ((np.arange(rows) + 0.5) * src_rows / rows).astype(int)
+    col_idx = ((np.arange(cols) + 0.5) * src_cols / cols).astype(int)
+    return values[row_idx[:, None], col_idx[None, :]]
+
+def rasterize_microchannels(csv_file, rows, cols, output_file=None):
+    # Rasterize a HotSpot microchannel geometry (one integer cell type per grid cell) at another grid resolution
+    # @csv_file: path to the geometry csv
+    # @rows, cols: target grid resolution
+    # @output_file: path to the rasterized csv, default to overwriting csv_file
+    # return: bool, False if the geometry is sampled coarser than it was drawn and may have lost channels
+
+    geometry = np.loadtxt(csv_file, delimiter=',', dtype=int, ndmin=2)
+    resampled = resample_grid(geometry, rows, cols)
+    np.savetxt(output_file or csv_file, resampled, delimiter=',', fmt='%d')
+    # channels narrower than a target cell disappear or merge when sampling coarser
+    return rows >= geometry.shape[0] and cols >= geometry.shape[1]
+
+def read_grid_array(grid_steady_file, rows, cols):
+    # Vectorized reader of a HotSpot grid steady file
+    # @grid_steady_file: path to a HotSpot grid steady file
+    # @rows, cols: grid resolution
+    # return: numpy array of shape (layers, rows, cols)
+
+    temps = np.loadtxt(grid_steady_file, comments='Layer', usecols=-1, ndmin=1)
+    return temps.reshape(-1, rows, cols)
+
+def convert_grid_steady(grid_steady_file, rows, cols, output_file, floorplans=None):
+    # Convert a HotSpot grid steady file once into a float32 .npy array with a json header next to it,
+    # so that consumers memory-map the layers they need instead of parsing text
+    # @grid_steady_file: path to a HotSpot grid steady file
+    # @rows, cols: grid resolution
+    # @output_file: path to the .npy file, the header goes to the same path with a .json extension
+    # @floorplans: list of the floorplan of each layer, bottom up, as given by match_layer
+    # return: dict, the header
+
+    grid = read_grid_array(grid_steady_file, rows, cols).astype(np.float32)
+    tmp_file = output_file + '.tmp.npy'
+    np.save(tmp_file, grid)
+    os.replace(tmp_file, output_file)
+    header = {
+        'layers': int(grid.shape[0]),
+        'rows': int(rows),
+        'cols': int(cols),
+        'dtype': 'float32',
+        'unit': 'K',
+        'floorplans': list(floorplans or []),
+    }
+    with open(grid_header_file(output_file), 'w') as f:
+        json.dump(header, f, indent=2)
+    return header
+
+def grid_header_file(grid_file):
+    return os.path.splitext(grid_file)[0] + '.json'
+
+def load_grid(grid_file):
+    # @grid_file: path to a .npy grid written by convert_grid_steady
+    # return: read-only memory-mapped numpy array of shape (layers, rows, cols), dict header
+    with open(grid_header_file(grid_file)) as f:
+        header = json.load(f)
+    return np.load(grid_file, mmap_mode='r'), header
@@ -0,0 +1,80 @@
+import numpy as np
+
+from utils.thermal_grid import write_grid_steady, write_block_steady
+
+# power in W injected into one block per HotSpot solve when building a kernel, large enough
+# that the two decimals HotSpot prints keep the response accurate
+UNIT_POWER = 10.0
+
+# The steady temperatures of a fixed stack are affine in the block power vector p as long as
+# leakage is fixed: T(p) = T(0) + R p. A thermal kernel holds T(0) and R, both for the block
+# temperatures of the steady file and for the grid cells of the grid steady file.
+
+def read_ptrace(ptrace_file):
+    # @ptrace_file: path to a HotSpot power trace
+    # return: list of block names, numpy array of shape (rows, blocks)
+
+    with open(ptrace_file) as f:
+        names = f.readline().split()
+        rows = [[float(value) for value in line.split()] for line in f if line.strip()]
+    return names, np.array(rows).reshape(-1, len(names))
+
+def write_unit_ptrace(block_names, block_idx, unit_power, output_file):
+    # Write a single-row power trace with unit_power in one block and zero elsewhere
+    # @block_idx: index of the powered block, None for an all-zero trace
+    power = ['0'] * len(block_names)
+    if block_idx is not None:
+        power[block_idx] = str(unit_power)
+    with open(output_file, 'w') as f:
+        f.write('\t'.join(block_names) + '\n')
+        f.write('\t'.join(power) + '\n')
+
+def assemble_kernel(block_names, baseline, responses, unit_power):
+    # @block_names: list of ptrace block names, the columns of the kernel
+    # @baseline: (list of steady block names, block temperatures, list of per layer grid temperatures) at zero power
+    # @responses: list of the same tuples, one per block powered with unit_power
+    # return: dict of numpy arrays, see save_kernel
+
+    steady_names, steady_base, grid_base = baseline
+    grid_base = np.concatenate(grid_base)
+    steady_response = np.empty((len(steady_base), len(block_names)))
+    grid_response = np.empty((len(grid_base), len(block_names)))
+    for i, (_, steady, grid) in enumerate(responses):
+        steady_response[:, i] = (steady - steady_base) / unit_power
+        grid_response[:, i] = (np.concatenate(grid) - grid_base) / unit_power
+    return {
+        'blocks': np.array(block_names),
+        'steady_names': np.array(steady_names),
+        'steady_base': steady_base,
+        'steady_response': steady_response,
+        'layer_cells': np.array([len(layer) for layer in baseline[2]]),
+        'grid_base': grid_base,
+        'grid_response': grid_response,
+    }
+
+def save_kernel(kernel, kernel_file):
+    np.savez(kernel_file, **kernel)
+
+def load_kernel(kernel_file):
+    with np.load(kernel_file) as data:
+        return {name: data[name] for name in data.files}
+
+def apply_kernel(kernel, ptrace_file, steady_file, grid_steady_file):
+    # Compute the steady temperatures of a power trace as HotSpot would, from the average power of its rows
+    # @kernel: dict of numpy arrays, see assemble_kernel
+    # @ptrace_file: path to the power trace
+    # @steady_file: path to the output block steady temperatures
+    # @grid_steady_file: path to the output grid steady temperatures
+
+    names, rows = read_ptrace(ptrace_file)
+    columns = {name: i for i, name in enumerate(kernel['blocks'].tolist())}
+    missing = [name for name in names if name not in columns]
+    if missing:
+        raise ValueError("Blocks not in the thermal kernel: " + ' '.join(missing))
+    power = np.zeros(len(columns))
+    for name, value in zip(names, rows.mean(axis=0)):
+        power[columns[name]] += value
+
+    write_block_steady(kernel['steady_names'].tolist(), kernel['steady_base'] + kernel['steady_response'] @ power, steady_file)
+    grid = kernel['grid_base'] + kernel['grid_response'] @ power
+    write_grid_steady(np.split(grid, np.cumsum(kernel['layer_cells'])[:-1]), grid_steady_file)
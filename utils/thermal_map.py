@@ -0,0 +1,83 @@
+import os
+import argparse
+
+from matplotlib.figure import Figure
+from matplotlib.patches import Rectangle
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+try:
+    from utils.thermal_grid import load_grid
+except ImportError:  # run as a script from the utils directory
+    from thermal_grid import load_grid
+
+def read_floorplan(flp_file):
+    # @flp_file: path to a HotSpot floorplan, '<unit>\t<width>\t<height>\t<left-x>\t<bottom-y>' lines
+    # return: list of (unit name, width, height, left x, bottom y) in meters
+
+    units = []
+    with open(flp_file) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 5 or line.startswith('#'):
+                continue
+            units.append((fields[0],) + tuple(float(value) for value in fields[1:5]))
+    return units
+
+def render_layer(temps, units, output_file, title=None):
+    # Render the thermal map of one layer with its floorplan on top
+    # @temps: numpy array of shape (rows, cols), row 0 at the top of the die
+    # @units: floorplan units as returned by read_floorplan, empty for layers without a floorplan
+    # @output_file: path to the png
+
+    # pyplot keeps global state, a standalone figure can be drawn from any stage thread
+    fig = Figure(figsize=(6, 5))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    if units:
+        width = max(x + w for _, w, _, x, _ in units)
+        height = max(y + h for _, _, h, _, y in units)
+    else:
+        width, height = temps.shape[1], temps.shape[0]
+    image = ax.imshow(temps, cmap='jet', origin='upper', extent=[0, width, 0, height], interpolation='nearest')
+    fig.colorbar(image, ax=ax, label='Temperature (K)')
+    for name, w, h, x, y in units:
+        ax.add_patch(Rectangle((x, y), w, h, fill=False, edgecolor='black', linewidth=0.5))
+        # only label units large enough to hold their name
+        if w > width / 16 and h > height / 32:
+            ax.text(x + w / 2, y + h / 2, name, ha='center', va='center', fontsize=5)
+    ax.set_xticks([])
+    ax.set_yticks([])
+    if title:
+        ax.set_title(title)
+    fig.savefig(output_file, dpi=150, bbox_inches='tight')
+
+def render_thermal_maps(grid, floorplans, outdir):
+    # Render the thermal maps of all the layers of a stack
+    # @grid: numpy array of shape (layers, rows, cols), e.g. memory-mapped by utils.thermal_grid.load_grid
+    # @floorplans: list of paths to the floorplan of each layer, bottom up, csv microchannel geometries get no overlay
+    # @outdir: output directory of the pngs
+    # return: list of paths to the pngs
+
+    if len(grid) < len(floorplans):
+        raise ValueError("The grid has %d layers but the stack has %d" % (len(grid), len(floorplans)))
+    # layers are rendered one after another, Agg holds the GIL so threads would not overlap them
+    outputs = []
+    for i, floorplan in enumerate(floorplans):
+        layer_name = os.path.basename(floorplan).split('.')[0]
+        output_file = os.path.join(outdir, 'layer' + str(i) + '_' + layer_name + '.png')
+        units = read_floorplan(floorplan) if floorplan.endswith('.flp') else []
+        render_layer(grid[i], units, output_file, 'Layer %d: %s' % (i, layer_name))
+        outputs.append(output_file)
+    return outputs
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render the thermal maps of a binary thermal grid')
+    parser.add_argument('--grid', type=str, help='coremem.grid.npy file written by the pipeline')
+    parser.add_argument('--inputs-dir', type=str, help='HotSpot inputs directory the floorplans in the grid header are relative to')
+    parser.add_argument('--outdir', type=str, help='output directory of the pngs', default='.')
+
+    args = parser.parse_args()
+    grid, header = load_grid(args.grid)
+    floorplans = [os.path.join(args.inputs_dir, floorplan) for floorplan in header['floorplans']]
+    for output_file in render_thermal_maps(grid, floorplans, args.outdir):
+        print(output_file)
@@ -0,0 +1,120 @@
+import os
+import json
+import argparse
+
+import numpy as np
+
+try:
+    from utils.thermal_grid import load_grid
+    from utils.thermal_map import read_floorplan
+except ImportError:  # run as a script from the utils directory
+    from thermal_grid import load_grid
+    from thermal_map import read_floorplan
+
+# default temperature above which a cell counts as part of a hotspot, 85C
+HOTSPOT_THRESHOLD = 358.15
+
+def rasterize_floorplan(units, rows, cols, width, height):
+    # Map every grid cell to the floorplan unit under its center
+    # @units: floorplan units as returned by utils.thermal_map.read_floorplan
+    # @rows, cols: grid resolution, row 0 at the top of the die
+    # @width, height: die size in meters
+    # return: numpy int array of shape (rows, cols), unit index or -1 where no unit covers the cell
+
+    labels = np.full((rows, cols), -1, dtype=int)
+    cell_x = (np.arange(cols) + 0.5) * width / cols
+    cell_y = height - (np.arange(rows) + 0.5) * height / rows
+    for i, (_, w, h, x, y) in enumerate(units):
+        in_cols = (cell_x >= x) & (cell_x < x + w)
+        in_rows = (cell_y >= y) & (cell_y < y + h)
+        labels[np.ix_(in_rows, in_cols)] = i
+    return labels
+
+def region_metrics(temps, gradient, cell_area, threshold):
+    # @temps: numpy array of the cell temperatures of a region
+    # @gradient: numpy array of the temperature gradient magnitude of the same cells, in K/mm
+    # @cell_area: float, area of one cell in mm^2
+    # @threshold: float, hotspot temperature threshold
+    # return: dict of metrics
+    hot = int(np.count_nonzero(temps > threshold))
+    return {
+        'peak': round(float(temps.max()), 3),
+        'mean': round(float(temps.mean()), 3),
+        'p99': round(float(np.percentile(temps, 99)), 3),
+        'max_gradient_K_per_mm': round(float(gradient.max()), 4),
+        'hotspot_area_mm2': round(hot * cell_area, 4),
+        'hotspot_fraction': round(hot / temps.size, 4),
+    }
+
+def die_size(floorplans):
+    # return: (width, height) of the die in meters, the extent of all the .flp floorplans
+    width = height = 0.0
+    for floorplan in floorplans:
+        if floorplan.endswith('.flp'):
+            for _, w, h, x, y in read_floorplan(floorplan):
+                width, height = max(width, x + w), max(height, y + h)
+    return width, height
+
+def compute_metrics(grid, floorplans, threshold=HOTSPOT_THRESHOLD):
+    # @grid: numpy array of shape (layers, rows, cols), e.g. memory-mapped by utils.thermal_grid.load_grid
+    # @floorplans: list of paths to the floorplan of each layer, bottom up
+    # @threshold: float, hotspot temperature threshold in K
+    # return: dict, per layer and per block metrics with a summary over the stack
+
+    _, rows, cols = grid.shape
+    width, height = die_size(floorplans)
+    if width == 0 or height == 0:
+        raise ValueError("No .flp floorplan found to size the die")
+    # cell pitch in mm
+    dy, dx = height * 1e3 / rows, width * 1e3 / cols
+    cell_area = dx * dy
+
+    layers = []
+    for i, floorplan in enumerate(floorplans):
+        temps = np.asarray(grid[i], dtype=np.float64)
+        grad_y, grad_x = np.gradient(temps, dy, dx)
+        gradient = np.hypot(grad_x, grad_y)
+        layer = {'layer': i, 'floorplan': os.path.basename(floorplan)}
+        layer.update(region_metrics(temps, gradient, cell_area, threshold))
+        layer['blocks'] = {}
+        if floorplan.endswith('.flp'):
+            units = read_floorplan(floorplan)
+            labels = rasterize_floorplan(units, rows, cols, width, height)
+            for j, (name, _, _, _, _) in enumerate(units):
+                mask = labels == j
+                # blocks smaller than a grid cell are not resolved
+                if mask.any():
+                    layer['blocks'][name] = region_metrics(temps[mask], gradient[mask], cell_area, threshold)
+        layers.append(layer)
+
+    hottest = max(layers, key=lambda layer: layer['peak'])
+    summary = {
+        'peak': hottest['peak'],
+        'peak_layer': hottest['layer'],
+        'mean': round(float(np.mean([layer['mean'] for layer in layers])), 3),
+        'max_gradient_K_per_mm': max(layer['max_gradient_K_per_mm'] for layer in layers),
+        'hotspot_area_mm2': round(sum(layer['hotspot_area_mm2'] for layer in layers), 4),
+    }
+    return {'threshold': threshold, 'resolution': [rows, cols], 'summary': summary, 'layers': layers}
+
+def write_metrics(grid_file, inputs_dir, output_file, threshold=HOTSPOT_THRESHOLD):
+    # @grid_file: path to a binary grid written by utils.thermal_grid.convert_grid_steady
+    # @inputs_dir: path to the HotSpot inputs directory the floorplans of the grid header are relative to
+    # @output_file: path to the metrics json
+    # return: dict, the metrics
+    grid, header = load_grid(grid_file)
+    floorplans = [os.path.join(inputs_dir, floorplan) for floorplan in header['floorplans']]
+    metrics = compute_metrics(grid, floorplans, threshold)
+    with open(output_file, 'w') as f:
+        json.dump(metrics, f, indent=2)
+    return metrics
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute thermal metrics of a binary thermal grid')
+    parser.add_argument('--grid', type=str, help='coremem.grid.npy file written by the pipeline')
+    parser.add_argument('--inputs-dir', type=str, help='HotSpot inputs directory the floorplans in the grid header are relative to')
+    parser.add_argument('--threshold', type=float, help='hotspot temperature threshold in K', default=HOTSPOT_THRESHOLD)
+    parser.add_argument('--output-file', type=str, help='output metrics json', default='metrics.json')
+
+    args = parser.parse_args()
+    print(json.dumps(write_metrics(args.grid, args.inputs_dir, args.output_file, args.threshold)['summary'], indent=2))
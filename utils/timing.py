@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import resource
+import threading
+import contextlib
+import contextvars
+import subprocess
+
+# span of the stage running in the current context, external commands are accounted to it
+current_span = contextvars.ContextVar('cool3d_span', default=None)
+
+def in_context(func):
+    # @func: callable to run in a worker thread
+    # return: callable running func in a copy of the caller's context, so that the commands
+    #         it launches from a thread pool are still accounted to the caller's stage
+    context = contextvars.copy_context()
+    def run(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return run
+
+def run_command(cmd, cwd=None):
+    # Run an external command like subprocess.run(cmd, cwd=cwd, check=True), recording its
+    # wall time, cpu time and peak resident memory in the span of the current stage
+    # @cmd: list of str, command line
+    # @cwd: str, working directory of the command
+
+    start = time.time()
+    process = subprocess.Popen(cmd, cwd=cwd)
+    # the rusage of this child alone, RUSAGE_CHILDREN mixes every child of the concurrent stages
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except BaseException:
+        # e.g. KeyboardInterrupt, do not leave the tool running unreaped
+        process.kill()
+        process.wait()
+        raise
+    # decoded like subprocess does, negative for a child killed by a signal
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    span = current_span.get()
+    if span is not None:
+        span.add_command({
+            'cmd': os.path.basename(cmd[0]),
+            'args': ' '.join(str(arg) for arg in cmd[1:]),
+            'start': start,
+            'wall_s': round(time.time() - start, 6),
+            'cpu_s': round(usage.ru_utime + usage.ru_stime, 6),
+            'max_rss_kb': usage.ru_maxrss,
+            'exit_status': process.returncode,
+            'tid': threading.get_ident(),
+        })
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    return process
+
+class Span:
+    # Wall time, python cpu time of the stage thread and external commands of one stage
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+        self.wall_s = None
+        self.python_cpu_s = None
+        self.status = 'running'
+        self.tid = threading.get_ident()
+        self.commands = []
+        self.lock = threading.Lock()
+
+    def add_command(self, command):
+        with self.lock:
+            self.commands.append(command)
+
+    def to_dict(self):
+        child_cpu_s = sum(command['cpu_s'] for command in self.commands)
+        return {
+            'start': self.start,
+            'wall_s': round(self.wall_s, 6),
+            'cpu_s': round(self.python_cpu_s + child_cpu_s, 6),
+            'python_cpu_s': round(self.python_cpu_s, 6),
+            'child_cpu_s': round(child_cpu_s, 6),
+            'max_rss_kb': max([command['max_rss_kb'] for command in self.commands], default=0),
+            'status': self.status,
+            'tid': self.tid,
+            'commands': sorted(self.commands, key=lambda command: command['start']),
+        }
+
+class Trace:
+    # Timings of the stages of one run, written to timings.json and optionally as a Chrome trace
+
+    def __init__(self):
+        self.start = time.time()
+        self.process_cpu_start = time.process_time()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        # Time the body as the stage @name, from the thread running it
+        span = Span(name)
+        span.start = time.time()
+        # thread cpu time, the other stages run in the same process meanwhile
+        thread_cpu_start = time.thread_time()
+        token = current_span.set(span)
+        try:
+            yield span
+            span.status = 'done'
+        except BaseException:
+            span.status = 'failed'
+            raise
+        finally:
+            current_span.reset(token)
+            span.wall_s = time.time() - span.start
+            span.python_cpu_s = time.thread_time() - thread_cpu_start
+            with self.lock:
+                self.spans.append(span)
+
+    def to_dict(self):
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        return {
+            'start': self.start,
+            'wall_s': round(time.time() - self.start, 6),
+            'python_cpu_s': round(time.process_time() - self.process_cpu_start, 6),
+            # high-water mark of the python process, rendering and grid loading happen in it
+            'python_max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'stages': {span.name: span.to_dict() for span in spans},
+        }
+
+    def write_timings(self, output_file):
+        # @output_file: path to timings.json
+        # return: dict, the timings
+        timings = self.to_dict()
+        with open(output_file, 'w') as f:
+            json.dump(timings, f, indent=2)
+        return timings
+
+def trace_events(timings, pid=0, label=None):
+    # Convert timings into Chrome trace_event records, one complete ('X') event per stage and command
+    # @timings: dict, as written to timings.json
+    # @pid: int, process id of the events in the viewer, one per design point in sweeps
+    # @label: str, name of the process in the viewer
+    # return: list of dict
+
+    events = []
+    if label is not None:
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': label}})
+    # thread idents are long and reused, number the lanes in order of first use instead
+    lanes = {}
+    for name, stage in timings['stages'].items():
+        tid = lanes.setdefault(('stage', name), len(lanes))
+        events.append({
+            'name': name, 'cat': 'stage', 'ph': 'X', 'pid': pid, 'tid': tid,
+            'ts': int(stage['start'] * 1e6), 'dur': int(stage['wall_s'] * 1e6),
+            'args': {key: stage[key] for key in ['cpu_s', 'python_cpu_s', 'child_cpu_s', 'max_rss_kb', 'status']},
+        })
+        for command in stage['commands']:
+            # commands from the stage's own thread nest under it, the ones from its pools get their own lanes
+            if command['tid'] == stage['tid']:
+                command_tid = tid
+            else:
+                command_tid = lanes.setdefault(('pool', name, command['tid']), len(lanes))
+            events.append({
+                'name': command['cmd'], 'cat': name, 'ph': 'X', 'pid': pid, 'tid': command_tid,
+                'ts': int(command['start'] * 1e6), 'dur': int(command['wall_s'] * 1e6),
+                'args': {key: command[key] for key in ['args', 'cpu_s', 'max_rss_kb', 'exit_status']},
+            })
+    return events
+
+def write_trace_events(events, output_file):
+    # @events: list of trace_event records
+    # @output_file: path to the json, loadable in chrome://tracing or https://ui.perfetto.dev
+    with open(output_file, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)